@@ -2,4 +2,8 @@
 set -e
 cd ~/epower
 source venv/bin/activate
-./manage.py run_periodic_tasks >/dev/null 2>> ~/epower/logs/errors.log
+# Periodic tasks do not fetch prices. They are fetched after the devices have been controlled,
+# so a slow price API never delays them, and even if the periodic tasks fail. New prices are
+# handled by the next run.
+./manage.py run_periodic_tasks >/dev/null 2>> ~/epower/logs/errors.log || true
+./manage.py fetch_prices >/dev/null 2>> ~/epower/logs/errors.log
@@ -13,6 +13,9 @@ DATABASES = {
         'USER': 'epower',
         'PASSWORD': '{{ mysql_password }}',
         'OPTIONS': {'charset': 'utf8mb4'},
+        # The scheduler keeps its connection between rounds, and replaces it when it is too old or broken
+        'CONN_MAX_AGE': 60 * 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -28,6 +31,14 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': '/home/epower/epower/logs/errors.log',
         },
+        # Summaries of every tick of the periodic tasks, as JSON lines
+        'metrics': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': '/home/epower/epower/logs/metrics.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 2,
+        },
     },
     'loggers': {
         'django.request': {
@@ -40,5 +51,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'nodes.metrics': {
+            'handlers': ['metrics', 'errors'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
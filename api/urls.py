@@ -10,6 +10,10 @@ urlpatterns = [
     path('logics/', nodes.api_views.LogicsListView.as_view()),
     path('countries/', nodes.api_views.CountriesListView.as_view()),
     path('timezones/', nodes.api_views.TimezonesListView.as_view()),
+    path('graph/', nodes.api_views.GraphView.as_view()),
+    path('metrics/', nodes.api_views.MetricsView.as_view()),
+    # This must be before the router, so it is not taken as an ID of a Node
+    path('nodes/stream/', nodes.api_views.node_states_stream),
 ]
 
 router = DefaultRouter()
@@ -159,5 +159,12 @@ NODE_LOGIC_CLASSES = [
     'nodes.logics.tapo_p100.TapoP100',
 ]
 
+# How many devices are updated at the same time, and how many seconds updating one device may take
+DEVICE_APPLY_WORKERS = 4
+DEVICE_APPLY_TIMEOUT = 30
+
+# If set, then day-ahead prices are read from this file instead of the ENTSO-E API, for example when testing
+ENTSOE_RESPONSE_FILE = None
+
 
 from .local_settings import *  # NOQA
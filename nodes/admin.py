@@ -14,3 +14,11 @@ class NodeAdmin(admin.ModelAdmin):
 @admin.register(models.Connection)
 class ConnectionAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(models.PriceHistory)
+class PriceHistoryAdmin(admin.ModelAdmin):
+
+    list_display = ('zone', 'start', 'resolution', 'price', 'fetched_at')
+    list_filter = ('zone',)
+    date_hierarchy = 'start'
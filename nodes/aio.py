@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Returns the event loop of this process.
+
+    The loop runs forever in its own thread, so things like aiohttp sessions
+    can be kept open between ticks, and it can be used from any thread.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='aio', daemon=True).start()
+    return _loop
+
+
+def run(coroutine, timeout=None):
+    """Runs a coroutine in the event loop of this process, and waits for its result.
+
+    This must not be called from a coroutine that is already running in the loop.
+    """
+    return submit(coroutine).result(timeout)
+
+
+def submit(coroutine):
+    """Starts running a coroutine in the event loop of this process, and returns a Future of its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+
+
+def gather(coroutines, timeout=None):
+    """Runs coroutines concurrently in the event loop of this process, and returns their results in order."""
+
+    async def gather_all():
+        return await asyncio.gather(*coroutines)
+
+    return run(gather_all(), timeout)
@@ -1,12 +1,24 @@
-from babel.dates import get_timezone_location
+import hashlib
+import json
+
 import pytz
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import translation
+from django.utils.http import parse_etags
+
+from rest_framework import authentication, exceptions, permissions, response, status, views, viewsets
+from rest_framework.utils import encoders
 
-from rest_framework import permissions, response, views, viewsets
+from . import constants, graph, live, metrics, models, serializers, state, utils
 
-from . import constants, models, serializers, utils
+
+# Seconds that browsers may use metadata responses without asking. After that, they are validated with the ETag.
+METADATA_MAX_AGE = 60 * 60 * 24
 
 
 class NodeViewSet(viewsets.ModelViewSet):
@@ -14,6 +26,31 @@ class NodeViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.NodeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        nodes = list(self.filter_queryset(self.get_queryset()))
+
+        # States of all Nodes are read from cache at once, instead of one by one
+        with state.StateSession(nodes):
+            serializer = self.get_serializer(nodes, many=True)
+            return response.Response(serializer.data)
+
+
+async def node_states_stream(request):
+    """Streams states and outputs of Nodes as Server-Sent Events, whenever they change.
+
+    This is served only through ASGI, because every stream keeps its connection open.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Streaming is available only through ASGI.', status=status.HTTP_501_NOT_IMPLEMENTED)
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+    stream_response = StreamingHttpResponse(live.stream_node_states(), content_type='text/event-stream')
+    stream_response['Cache-Control'] = 'no-cache'
+    # Tell Nginx not to buffer the events
+    stream_response['X-Accel-Buffering'] = 'no'
+    return stream_response
+
 
 class ConnectionViewSet(viewsets.ModelViewSet):
     queryset = models.Connection.objects.all().order_by('id')
@@ -21,9 +58,165 @@ class ConnectionViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class LogicsListView(views.APIView):
+class MetricsView(views.APIView):
+    """Metrics of the hooks of every Node in the text format of Prometheus.
+
+    Basic authentication is allowed too, because Prometheus cannot log in with a session.
+    """
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
+        return HttpResponse(metrics.get_prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _etag_matches(request, etag):
+    # Weak comparison is used, as it should be with If-None-Match
+    if_none_match = [
+        tag[2:] if tag.startswith('W/') else tag
+        for tag in parse_etags(request.headers.get('If-None-Match', ''))
+    ]
+    return etag in if_none_match or '*' in if_none_match
+
+
+class GraphView(views.APIView):
+    """All Nodes, their states, and all Connections in one snapshot.
+
+    The ETag is made of the versions of the graph and the states, so checking
+    if anything has changed costs no database queries. POST applies a batch of
+    changes (see GraphChangesSerializer) in one transaction, and returns the
+    new snapshot.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        etag = self._get_etag()
+        # Browsers must always ask, if the snapshot is still valid
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if _etag_matches(request, etag):
+            return response.Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return response.Response(self._get_snapshot(etag), headers=headers)
+
+    def post(self, request):
+        changes_serializer = serializers.GraphChangesSerializer(data=request.data)
+        changes_serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            self._apply_changes(changes_serializer.validated_data)
+
+        etag = self._get_etag()
+        return response.Response(self._get_snapshot(etag), headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    def _get_etag(self):
+        # Versions are read before the data, so if the data changes in between, the next request gets it
+        return '"{}-{}"'.format(graph.get_version(), state.get_version())
+
+    def _get_snapshot(self, etag):
+        nodes = list(models.Node.objects.all().order_by('name'))
+        connections = models.Connection.objects.all().order_by('id')
+        with state.StateSession(nodes):
+            return {
+                'version': etag.strip('"'),
+                'nodes': serializers.NodeSerializer(nodes, many=True).data,
+                'connections': serializers.ConnectionSerializer(connections, many=True).data,
+            }
+
+    def _apply_changes(self, changes):
+        # Connections are deleted first, so their inputs can be used by the new ones
+        models.Connection.objects.filter(id__in=changes['deleted_connections']).delete()
+
+        nodes = models.Node.objects.in_bulk(_get_ids(changes['nodes']))
+        moved_nodes = []
+        for index, item in enumerate(changes['nodes']):
+            node = nodes.get(item.get('id'))
+            if node is None:
+                raise exceptions.ValidationError(
+                    {'nodes': {index: {'id': translation.gettext('Node does not exist!')}}},
+                )
+            node_serializer = serializers.NodeSerializer(node, data=item, partial=True)
+            self._validate(node_serializer, 'nodes', index)
+            # Moves are common, and they do not need the Logic, so they are saved with a single query
+            if set(node_serializer.validated_data) <= {'pos_x', 'pos_y'}:
+                for field, value in node_serializer.validated_data.items():
+                    setattr(node, field, value)
+                moved_nodes.append(node)
+            else:
+                self._save(node_serializer, 'nodes', index)
+        if moved_nodes:
+            models.Node.objects.bulk_update(moved_nodes, ['pos_x', 'pos_y'])
+            # Signals are not sent by bulk_update()
+            transaction.on_commit(graph.invalidate)
+
+        connections = models.Connection.objects.in_bulk(_get_ids(changes['connections']))
+        for index, item in enumerate(changes['connections']):
+            connection = connections.get(item.get('id'))
+            if connection is None:
+                raise exceptions.ValidationError(
+                    {'connections': {index: {'id': translation.gettext('Connection does not exist!')}}},
+                )
+            connection_serializer = serializers.ConnectionSerializer(connection, data=item, partial=True)
+            self._validate(connection_serializer, 'connections', index)
+            self._save(connection_serializer, 'connections', index)
+
+        for index, item in enumerate(changes['new_connections']):
+            connection_serializer = serializers.ConnectionSerializer(data=item)
+            self._validate(connection_serializer, 'new_connections', index)
+            self._save(connection_serializer, 'new_connections', index)
+
+    def _validate(self, serializer, field, index):
+        if not serializer.is_valid():
+            raise exceptions.ValidationError({field: {index: serializer.errors}})
+
+    def _save(self, serializer, field, index):
+        # Serializers validate some things only when saving, so the errors are wrapped here too
+        try:
+            serializer.save()
+        except exceptions.ValidationError as error:
+            raise exceptions.ValidationError({field: {index: error.detail}})
+
+
+def _get_ids(items):
+    # Invalid IDs are left out, so they are reported as missing objects
+    return [item['id'] for item in items if isinstance(item.get('id'), int)]
+
+
+class CachedMetadataView(views.APIView):
+    """Base for views whose data changes only when the code changes.
+
+    The data is built once per process and language, and served with a strong ETag
+    that is a hash of its content, so conditional requests get an empty 304 response.
+    Subclasses implement `get_data()`.
+    """
+
+    # (view class, language) -> (ETag, data)
+    _cached_responses = {}
+
+    def get(self, request):
+        language = translation.get_language() or settings.LANGUAGE_CODE
+        cache_key = (type(self), language)
+        cached_response = self._cached_responses.get(cache_key)
+        if cached_response is None:
+            # Data is converted to JSON and back, so lazy translations are evaluated only once
+            content = json.dumps(self.get_data(), cls=encoders.JSONEncoder)
+            etag = '"{}"'.format(hashlib.sha256(content.encode()).hexdigest()[:32])
+            cached_response = (etag, json.loads(content))
+            self._cached_responses[cache_key] = cached_response
+        etag, data = cached_response
+
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'max-age={}'.format(METADATA_MAX_AGE),
+        }
+        if _etag_matches(request, etag):
+            return response.Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return response.Response(data, headers=headers)
+
+    def get_data(self):
+        raise NotImplementedError()
+
+
+class LogicsListView(CachedMetadataView):
+
+    def get_data(self):
         logics = {}
 
         for logic_class in settings.NODE_LOGIC_CLASSES:
@@ -34,18 +227,20 @@ class LogicsListView(views.APIView):
                 'settings_fields': logic.get_settings_fields(),
             }
 
-        return response.Response(logics)
+        return logics
 
 
-class CountriesListView(views.APIView):
+class CountriesListView(CachedMetadataView):
 
-    def get(self, request):
-        return response.Response(constants.COUNTRIES)
+    def get_data(self):
+        return constants.COUNTRIES
 
 
-class TimezonesListView(views.APIView):
+class TimezonesListView(CachedMetadataView):
 
-    def get(self, request):
+    def get_data(self):
+        # Babel is imported only here, because it is slow to import and not needed elsewhere
+        from babel.dates import get_timezone_location
 
         timezones = []
 
@@ -56,4 +251,4 @@ class TimezonesListView(views.APIView):
                 '{} ({})'.format(tz, get_timezone_location(tz, locale=locale))
             ])
 
-        return response.Response(timezones)
+        return timezones
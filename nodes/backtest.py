@@ -0,0 +1,183 @@
+import time
+
+from . import engine, graph, prices, state, tasks, utils
+from .logics import logic
+from .price_series import PRICE_SCALE
+
+
+# Longest simulated time between two rounds, for Logics that do not tell when their outputs change
+MAX_ROUND_INTERVAL = 60 * 60
+
+
+class BacktestResult:
+    """Results of one backtest. `outputs` has a row for every on/off output of every Node."""
+
+    def __init__(self, start, end, rounds, duration, average_price, outputs):
+        self.start = start
+        self.end = end
+        self.rounds = rounds
+        # Seconds of real time that the backtest took
+        self.duration = duration
+        # Average price of the whole time range, in price units per MWh, or None if there were no prices
+        self.average_price = average_price
+        self.outputs = outputs
+
+    def to_dict(self):
+        return {
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'rounds': self.rounds,
+            'duration': self.duration,
+            'average_price': self.average_price,
+            'outputs': self.outputs,
+        }
+
+
+class StubDevice(logic.Logic):
+    """Replaces a Logic that controls a real device. It remembers its power, and outputs only that."""
+
+    def __init__(self, node, original_logic):
+        super().__init__(node)
+        self.original_logic = original_logic
+
+    def get_input_keys(self):
+        return self.original_logic.get_input_keys()
+
+    def handle_inputs_changed(self, inputs):
+        self.node.set_state({'power': inputs.get('power')})
+
+    def get_output_values(self):
+        power = self.node.get_state().get('power')
+        if power is None:
+            return {}
+        return {'power': bool(power)}
+
+
+def replace_devices_with_stubs(nodes):
+    """Replaces Logics of the given Nodes with StubDevices, if they control real devices."""
+    for node in nodes:
+        original_logic = node.get_logic()
+        if original_logic.controls_devices:
+            node._cached_logic = StubDevice(node, original_logic)
+
+
+class MemoryStateBackend:
+    """Keeps states of Nodes in memory, so backtests do not touch the states of the live system."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get_many(self, keys):
+        return {key: self.values[key] for key in keys if key in self.values}
+
+    def set_many(self, values, timeout=None):
+        self.values.update(values)
+
+
+def run_backtest(start, end, area=None, load_kw=1):
+    """Replays stored price history from `start` to `end` through the current graph of Nodes.
+
+    Logics are run against a VirtualClock, and states are kept in memory. Devices are replaced
+    with StubDevices. Prices are given to the Logics at the moments they would have been published,
+    and rounds are run only when some output may change, so a year takes about as many rounds
+    as there are changes. Every on/off output is assumed to control a load of `load_kw` kilowatts.
+    """
+    started_at = time.monotonic()
+    start_timestamp = int(start.timestamp())
+    end_timestamp = int(end.timestamp())
+
+    # Prices are loaded only once. The first round needs the prices of the previous day too.
+    history_start = prices.get_wanted_interval(start)[0]
+    history_end = prices.get_wanted_interval(end)[1]
+    price_history = prices.get_history(history_start, history_end, area)
+    if price_history is None:
+        raise ValueError('Price area is not known!')
+
+    # A new graph is loaded, so its Logics are not shared with the live system
+    compiled_graph = graph.CompiledGraph.load()
+    nodes = compiled_graph.nodes
+    replace_devices_with_stubs(nodes.values())
+
+    # (Node ID, output key) -> [seconds on, sum of price times seconds while on, whether all values were on/off]
+    totals = {}
+    rounds = 0
+    known_prices_end = None
+
+    with utils.VirtualClock(start_timestamp) as clock, state.StateSession(nodes.values(), MemoryStateBackend()):
+        while clock.timestamp < end_timestamp:
+            now = clock.timestamp
+            rounds += 1
+
+            for node in nodes.values():
+                node.get_logic().handle_tick_started()
+
+            # Give the prices when the next ones have been published, like fetching prices would
+            known_start, known_end, prices_change = prices.get_wanted_interval(utils.now())
+            if known_end != known_prices_end:
+                # Like in cache, only the latest prices are kept
+                known_prices = price_history.slice_time(known_start.timestamp(), known_end.timestamp()) \
+                    .slice(-(prices.PRICES_KEEP_SECONDS // price_history.resolution))
+                if len(known_prices):
+                    for node in nodes.values():
+                        node.get_logic().handle_updated_prices(known_prices)
+                known_prices_end = known_end
+
+            outputs = engine.propagate(compiled_graph)
+
+            next_round = min(
+                tasks.get_next_change_time(nodes.values()) or end_timestamp,
+                prices_change.timestamp(),
+                now + MAX_ROUND_INTERVAL,
+                end_timestamp,
+            )
+            # Rounds are never run more often than once per second, like in the scheduler
+            next_round = max(int(next_round), now + 1)
+
+            for node_id, values in outputs.items():
+                for key, value in values.items():
+                    if value is None:
+                        continue
+                    total = totals.setdefault((node_id, key), [0, 0, True])
+                    # An output is on/off only if all its values are, so for example
+                    # an output that switches between 5 and 1 is never counted as on.
+                    if not total[2] or not _is_on_off(value):
+                        total[2] = False
+                        continue
+                    if value:
+                        total[0] += next_round - now
+                        total[1] += price_history.get_integral(now, next_round)
+
+            clock.timestamp = next_round
+
+    # Price units are per MWh, so the sums of price times seconds are converted to price times hours
+    load_mw = load_kw / 1000
+    price_seconds = price_history.get_integral(start_timestamp, end_timestamp)
+    covered_seconds = max(0, min(end_timestamp, price_history.end) - max(start_timestamp, price_history.start))
+    average_price = price_seconds / covered_seconds / PRICE_SCALE if covered_seconds else None
+
+    outputs = []
+    for (node_id, key), (seconds_on, price_seconds_on, is_on_off) in sorted(totals.items()):
+        if not is_on_off:
+            continue
+        outputs.append({
+            'node': node_id,
+            'name': nodes[node_id].name,
+            'output': key,
+            'hours_on': seconds_on / 3600,
+            'cost': price_seconds_on / PRICE_SCALE / 3600 * load_mw,
+            'average_price': price_seconds_on / seconds_on / PRICE_SCALE if seconds_on else None,
+        })
+
+    return BacktestResult(
+        start=start,
+        end=end,
+        rounds=rounds,
+        duration=time.monotonic() - started_at,
+        average_price=average_price,
+        outputs=outputs,
+    )
+
+
+def _is_on_off(value):
+    # Logics use both booleans and ones and zeros for signals
+    return isinstance(value, bool) or (isinstance(value, int) and value in (0, 1))
@@ -0,0 +1,231 @@
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import backtest, graph, metrics, models, price_series, prices, tasks, utils
+
+
+SHAPES = ('chain', 'fanout', 'cycles', 'mixed')
+
+CLOCK = 'nodes.logics.clock.Clock'
+LOGICAL_AND = 'nodes.logics.logical_and.LogicalAnd'
+PRICE_BASED_ON_OFF = 'nodes.logics.price_based_on_off.PriceBasedOnOff'
+SELECT_VALUE = 'nodes.logics.select_value.SelectValue'
+SIMPLE_CHEAPEST_HOURS = 'nodes.logics.simple_cheapest_hours.SimpleCheapestHours'
+TAPO_P100 = 'nodes.logics.tapo_p100.TapoP100'
+
+# Settings, input keys and output keys of the Logics that are used in the graphs
+LOGICS = {
+    CLOCK: ({'start': '08:00', 'end': '16:00'}, [], 'power'),
+    LOGICAL_AND: ({}, ['input1', 'input2'], 'output'),
+    PRICE_BASED_ON_OFF: (
+        {'min_on_hours': 1, 'max_on_hours': 4, 'min_off_hours': 2, 'max_off_hours': 6},
+        [],
+        'power',
+    ),
+    SELECT_VALUE: ({'value_on': 1, 'value_off': 0}, ['input'], 'output'),
+    SIMPLE_CHEAPEST_HOURS: ({'on_hours': 4, 'min_off_hours': 12}, [], 'power'),
+    TAPO_P100: ({'ip': '127.0.0.1', 'username': 'benchmark', 'password': 'benchmark'}, ['power'], None),
+}
+
+# Simulated time between the rounds, so the outputs of the Logics keep changing
+ROUND_INTERVAL = 15 * 60
+
+# Methods of the cache, that are one round trip to memcached each
+_ROUND_TRIP_METHODS = (
+    'add', 'get', 'set', 'touch', 'delete', 'get_many', 'set_many', 'delete_many', 'has_key', 'incr', 'decr',
+    'clear',
+)
+
+# How deep the current thread is in the methods of CountingLocMemCache
+_cache_call_depth = threading.local()
+
+
+class CountingLocMemCache(LocMemCache):
+    """In-process stand-in for memcached, that counts the round trips memcached would need.
+
+    Methods of the base class call each other, for example `get_many()` calls `get()`
+    for every key, so only the outermost call is counted.
+    """
+
+    round_trips = 0
+
+
+def _counting_method(name):
+    original_method = getattr(LocMemCache, name)
+
+    def method(self, *args, **kwargs):
+        depth = getattr(_cache_call_depth, 'value', 0)
+        if depth == 0:
+            CountingLocMemCache.round_trips += 1
+        _cache_call_depth.value = depth + 1
+        try:
+            return original_method(self, *args, **kwargs)
+        finally:
+            _cache_call_depth.value = depth
+
+    return method
+
+
+for _name in _ROUND_TRIP_METHODS:
+    setattr(CountingLocMemCache, _name, _counting_method(_name))
+
+
+def generate_graph(shape, size, seed=0):
+    """Returns a CompiledGraph of `size` unsaved Nodes, that are connected in the given shape.
+
+    chain: a Clock followed by Select values, and a device at the end
+    fanout: one price based Node controlling all the others
+    cycles: rings of three Logical ands, that all get their other input from one Clock
+    mixed: random Logics connected randomly in mostly topological order, with some cycles
+    """
+    rand = random.Random(seed)
+    logic_classes = []
+    # (source index, dest index, dest key)
+    connections = []
+
+    if shape == 'chain':
+        logic_classes.append(CLOCK)
+        for index in range(1, size):
+            logic_classes.append(TAPO_P100 if index == size - 1 else SELECT_VALUE)
+            connections.append((index - 1, index, LOGICS[logic_classes[-1]][1][0]))
+
+    elif shape == 'fanout':
+        logic_classes.append(PRICE_BASED_ON_OFF)
+        for index in range(1, size):
+            logic_classes.append(TAPO_P100 if index % 2 else SELECT_VALUE)
+            connections.append((0, index, LOGICS[logic_classes[-1]][1][0]))
+
+    elif shape == 'cycles':
+        logic_classes.append(CLOCK)
+        while len(logic_classes) + 3 <= size:
+            ring = [len(logic_classes), len(logic_classes) + 1, len(logic_classes) + 2]
+            for position, index in enumerate(ring):
+                logic_classes.append(LOGICAL_AND)
+                connections.append((ring[position - 1], index, 'input1'))
+                connections.append((0, index, 'input2'))
+        while len(logic_classes) < size:
+            logic_classes.append(SELECT_VALUE)
+            connections.append((0, len(logic_classes) - 1, 'input'))
+
+    elif shape == 'mixed':
+        sources = [CLOCK, PRICE_BASED_ON_OFF, SIMPLE_CHEAPEST_HOURS]
+        consumers = [LOGICAL_AND, SELECT_VALUE, TAPO_P100]
+        # Indices of the Nodes that have an output
+        with_output = []
+        for index in range(size):
+            if index == 0 or rand.random() < 0.2:
+                logic_classes.append(rand.choice(sources))
+            else:
+                logic_classes.append(rand.choice(consumers))
+                for input_key in LOGICS[logic_classes[-1]][1]:
+                    # Some inputs come from later Nodes, so there are cycles too
+                    if rand.random() < 0.02:
+                        connections.append((None, index, input_key))
+                    else:
+                        connections.append((rand.choice(with_output), index, input_key))
+            if LOGICS[logic_classes[-1]][2]:
+                with_output.append(index)
+        connections = [
+            (rand.choice(with_output) if source is None else source, dest, dest_key)
+            for source, dest, dest_key in connections
+        ]
+
+    else:
+        raise ValueError(f'Unknown shape {shape}')
+
+    nodes = {}
+    for index, logic_class in enumerate(logic_classes):
+        node = models.Node(id=index + 1, name=f'{shape} {index}', logic_class=logic_class,
+            settings=dict(LOGICS[logic_class][0]))
+        nodes[node.id] = node
+    connections = [
+        (source + 1, LOGICS[logic_classes[source]][2], dest + 1, dest_key)
+        for source, dest, dest_key in connections
+    ]
+    return graph.CompiledGraph(nodes, connections)
+
+
+def run_benchmark(shape, size, rounds=5, seed=0):
+    """Runs `rounds` + 1 rounds of the periodic tasks with a synthetic graph, and returns the measurements.
+
+    Memcached is replaced with CountingLocMemCache, and devices with StubDevices. The first round
+    is reported separately, because it handles the prices. Peak memory is measured in one more
+    round, because tracing memory slows everything down.
+    """
+    with override_settings(CACHES={
+        'default': {
+            'BACKEND': 'nodes.benchmark.CountingLocMemCache',
+            'LOCATION': 'benchmark',
+            # Memcached has room for all states, so nothing may be culled
+            'OPTIONS': {'MAX_ENTRIES': 10 ** 9},
+        },
+    }):
+        cache.clear()
+        metrics.reset()
+        compiled_graph = generate_graph(shape, size, seed)
+        compiled_graph.version = graph.get_version()
+        backtest.replace_devices_with_stubs(compiled_graph.nodes.values())
+
+        # Prices from the previous day to the end of the next one
+        start = int(time.time()) // 3600 * 3600
+        rand = random.Random(seed)
+        prices.store_to_cache(price_series.PriceSeries(
+            start - 24 * 3600,
+            3600,
+            [rand.randint(-5000, 300000) for hour in range(72)],
+        ))
+
+        graph._compiled_graph = compiled_graph
+        try:
+            with utils.VirtualClock(start) as clock:
+                measurements = []
+                for round_number in range(rounds + 1):
+                    measurements.append(_measure_round())
+                    clock.timestamp += ROUND_INTERVAL
+
+                tracemalloc.start()
+                try:
+                    tasks.run_periodic_tasks()
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        finally:
+            graph._compiled_graph = None
+
+    first, rest = measurements[0], measurements[1:]
+    return {
+        'shape': shape,
+        'size': size,
+        'connections': sum(len(inputs) for inputs in compiled_graph.inputs.values()),
+        'components': len(compiled_graph.get_components()),
+        'first_round': first,
+        'rounds': {
+            'count': len(rest),
+            'median_seconds': statistics.median(m['seconds'] for m in rest) if rest else None,
+            'max_seconds': max((m['seconds'] for m in rest), default=None),
+            'queries': max((m['queries'] for m in rest), default=None),
+            'cache_round_trips': max((m['cache_round_trips'] for m in rest), default=None),
+        },
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def _measure_round():
+    CountingLocMemCache.round_trips = 0
+    with CaptureQueriesContext(connection) as queries:
+        started_at = time.perf_counter()
+        tasks.run_periodic_tasks()
+        duration = time.perf_counter() - started_at
+    return {
+        'seconds': duration,
+        'queries': len(queries),
+        'cache_round_trips': CountingLocMemCache.round_trips,
+    }
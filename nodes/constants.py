@@ -7,6 +7,7 @@ COUNTRIES = {
         'timezones': 'Europe/Helsinki',
         'price_source': {
             'type': 'entsoe',
+            'area': '10YFI-1--------U',
         }
     }
 }
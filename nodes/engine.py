@@ -0,0 +1,110 @@
+import logging
+import time
+
+from . import aio, metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# How many times the Nodes of a cycle are re-evaluated, before giving up on waiting them to settle
+MAX_CYCLE_ITERATIONS = 10
+
+
+def propagate(graph, max_cycle_iterations=MAX_CYCLE_ITERATIONS):
+    """Lets values flow from outputs of Nodes to inputs of other Nodes.
+
+    Nodes are evaluated in topological order, so every Node sees the final outputs of the Nodes it
+    depends on, and `handle_inputs_changed()` is called only once for it. Nodes that form a cycle
+    are evaluated together, and they are iterated until their inputs stop changing, or until
+    `max_cycle_iterations` is reached.
+
+    Logics that implement `async_get_output_values()` are awaited concurrently with the other
+    asynchronous Logics of the same level of the graph, because those do not depend on each other.
+
+    `graph` is a CompiledGraph, so no database queries are needed. Returns the
+    final outputs of all Nodes as a dict by Node IDs.
+    """
+
+    nodes = graph.nodes
+    inputs_by_dest = graph.inputs
+    outputs = {}
+
+    def gather_inputs(node_id):
+        inputs = {}
+        for dest_key, source_id, source_key in inputs_by_dest.get(node_id, ()):
+            inputs[dest_key] = outputs.get(source_id, {}).get(source_key)
+        return inputs
+
+    for level in graph.get_levels():
+
+        # Asynchronous Logics of this level, as (Node ID, Logic) pairs
+        async_logics = []
+
+        for component in level:
+
+            # Simple case, a Node that is not part of any cycle
+            if not graph.is_cycle(component):
+                node = nodes[component[0]]
+                logic = node.get_logic()
+                inputs = gather_inputs(component[0])
+                with metrics.hook(node, 'handle_inputs_changed'):
+                    logic.handle_inputs_changed(inputs)
+                if logic.implements('async_get_output_values'):
+                    async_logics.append((component[0], logic))
+                else:
+                    with metrics.hook(node, 'get_output_values'):
+                        outputs[component[0]] = logic.get_output_values() or {}
+                continue
+
+            # Nodes of a cycle start from the outputs they had before this round
+            for node_id in component:
+                outputs[node_id] = _get_output_values(nodes[node_id].get_logic())
+
+            # Iterate until inputs of the Nodes stop changing
+            old_inputs = {}
+            for i in range(max_cycle_iterations):
+                changed = False
+                for node_id in component:
+                    new_inputs = gather_inputs(node_id)
+                    if node_id in old_inputs and old_inputs[node_id] == new_inputs:
+                        continue
+                    old_inputs[node_id] = new_inputs
+                    logic = nodes[node_id].get_logic()
+                    with metrics.hook(nodes[node_id], 'handle_inputs_changed'):
+                        logic.handle_inputs_changed(new_inputs)
+                    outputs[node_id] = _get_output_values(logic)
+                    changed = True
+                if not changed:
+                    break
+            else:
+                logger.warning('Cycle of Nodes {} did not settle in {} iterations'.format(
+                    sorted(component),
+                    max_cycle_iterations,
+                ))
+
+        if async_logics:
+            results = aio.gather([_timed_async_get_output_values(logic) for node_id, logic in async_logics])
+            for (node_id, logic), result in zip(async_logics, results):
+                outputs[node_id] = result or {}
+
+    return outputs
+
+
+def _get_output_values(logic):
+    if logic.implements('async_get_output_values'):
+        return aio.run(_timed_async_get_output_values(logic)) or {}
+    with metrics.hook(logic.node, 'get_output_values'):
+        return logic.get_output_values() or {}
+
+
+async def _timed_async_get_output_values(logic):
+    # Coroutines run concurrently, so they are timed here instead of with metrics.hook()
+    started_at = time.perf_counter()
+    failed = True
+    try:
+        result = await logic.async_get_output_values()
+        failed = False
+        return result
+    finally:
+        metrics.add(logic.node, 'async_get_output_values', time.perf_counter() - started_at, failed)
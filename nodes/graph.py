@@ -0,0 +1,168 @@
+import uuid
+
+from django.core.cache import cache
+
+from . import models
+
+
+GRAPH_VERSION_CACHE_KEY = 'graph_version'
+
+
+class CompiledGraph:
+    """In-memory snapshot of all Nodes and the Connections between them.
+
+    Connections are stored as flat adjacency indices, so walking through the
+    graph does not need any database queries. The snapshot is identified by
+    a version, that changes every time a Node or a Connection is modified.
+    """
+
+    def __init__(self, nodes, connections, version=None):
+        self.nodes = nodes
+        self.version = version
+
+        # Source Node ID -> [(dest Node ID, dest key, source key), ...]
+        self.outputs = {}
+        # Dest Node ID -> [(dest key, source Node ID, source key), ...]
+        self.inputs = {}
+        # Source Node ID -> set of dest Node IDs
+        self.successors = {}
+
+        for source_id, source_key, dest_id, dest_key in connections:
+            # Ignore Connections to unknown Nodes
+            if source_id not in nodes or dest_id not in nodes:
+                continue
+            self.outputs.setdefault(source_id, []).append((dest_id, dest_key, source_key))
+            self.inputs.setdefault(dest_id, []).append((dest_key, source_id, source_key))
+            self.successors.setdefault(source_id, set()).add(dest_id)
+
+        self._components = None
+        self._levels = None
+
+    @classmethod
+    def load(cls):
+        version = get_version()
+        nodes = {node.id: node for node in models.Node.objects.all()}
+        connections = models.Connection.objects.values_list('source_id', 'source_key', 'dest_id', 'dest_key')
+        return cls(nodes, connections, version)
+
+    def get_components(self):
+        """Returns strongly connected components of the graph in topological order."""
+        if self._components is None:
+            self._components = _strongly_connected_components(self.nodes.keys(), self.successors)
+        return self._components
+
+    def get_levels(self):
+        """Returns strongly connected components grouped to levels.
+
+        Components of the same level never depend on each other, so they can be evaluated
+        concurrently. Components depend only on components of the earlier levels.
+        """
+        if self._levels is None:
+            components = self.get_components()
+            component_indices = {
+                node_id: component_index
+                for component_index, component in enumerate(components)
+                for node_id in component
+            }
+            component_levels = []
+            self._levels = []
+            for component_index, component in enumerate(components):
+                level = 0
+                for node_id in component:
+                    for dest_key, source_id, source_key in self.inputs.get(node_id, ()):
+                        source_index = component_indices[source_id]
+                        if source_index != component_index:
+                            level = max(level, component_levels[source_index] + 1)
+                component_levels.append(level)
+                if level == len(self._levels):
+                    self._levels.append([])
+                self._levels[level].append(component)
+        return self._levels
+
+    def is_cycle(self, component):
+        return len(component) > 1 or component[0] in self.successors.get(component[0], ())
+
+
+_compiled_graph = None
+
+
+def get_compiled_graph():
+    """Returns the CompiledGraph, and reloads it only if the graph has been modified."""
+    global _compiled_graph
+    if _compiled_graph is None or _compiled_graph.version != get_version():
+        _compiled_graph = CompiledGraph.load()
+    return _compiled_graph
+
+
+def get_version():
+    version = cache.get(GRAPH_VERSION_CACHE_KEY)
+    if version is None:
+        # If cache has been cleared, then start a new version. If another
+        # process does the same at the same time, use the one it created.
+        cache.add(GRAPH_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(GRAPH_VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate():
+    cache.set(GRAPH_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def _strongly_connected_components(node_ids, successors):
+    """Returns strongly connected components of the graph in topological order.
+
+    This is an iterative version of Tarjan's algorithm, so it works
+    also with graphs that are deeper than the recursion limit.
+    """
+    index_counter = 0
+    indices = {}
+    lowlinks = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root_id in node_ids:
+        if root_id in indices:
+            continue
+
+        indices[root_id] = lowlinks[root_id] = index_counter
+        index_counter += 1
+        stack.append(root_id)
+        on_stack.add(root_id)
+        work = [(root_id, iter(successors.get(root_id, ())))]
+
+        while work:
+            node_id, children = work[-1]
+            descended = False
+            for child_id in children:
+                if child_id not in indices:
+                    indices[child_id] = lowlinks[child_id] = index_counter
+                    index_counter += 1
+                    stack.append(child_id)
+                    on_stack.add(child_id)
+                    work.append((child_id, iter(successors.get(child_id, ()))))
+                    descended = True
+                    break
+                if child_id in on_stack:
+                    lowlinks[node_id] = min(lowlinks[node_id], indices[child_id])
+            if descended:
+                continue
+
+            # All children are handled, so check if this is a root of a component
+            work.pop()
+            if work:
+                parent_id = work[-1][0]
+                lowlinks[parent_id] = min(lowlinks[parent_id], lowlinks[node_id])
+            if lowlinks[node_id] == indices[node_id]:
+                component = []
+                while True:
+                    member_id = stack.pop()
+                    on_stack.discard(member_id)
+                    component.append(member_id)
+                    if member_id == node_id:
+                        break
+                components.append(component)
+
+    # Tarjan's algorithm finds components in reverse topological order
+    components.reverse()
+    return components
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from . import graph, models, state
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds between checks, if states or outputs of Nodes have changed
+POLL_INTERVAL = 1
+
+# Seconds between comments that keep idle connections open
+KEEPALIVE_INTERVAL = 20
+
+# Seconds after a stream is ended, and the browser reconnects. Streams are not kept open forever,
+# because Django does not notice, if a client disconnects, so every stream must end at some point.
+MAX_STREAM_DURATION = 60 * 10
+RECONNECT_DELAY = 1
+
+
+class Subscription:
+    """Changes that are waiting to be sent to one client.
+
+    If the client is slower than the changes, then the changes are coalesced,
+    so only the latest data of every Node is sent.
+    """
+
+    def __init__(self):
+        self.changed = {}
+        self.removed = set()
+        self.graph_changed = False
+        self.event = asyncio.Event()
+
+    def add(self, changed, removed, graph_changed):
+        self.changed.update(changed)
+        for node_id in changed:
+            self.removed.discard(node_id)
+        for node_id in removed:
+            self.changed.pop(node_id, None)
+            self.removed.add(node_id)
+        self.graph_changed = self.graph_changed or graph_changed
+        self.event.set()
+
+    def pop(self):
+        changed, removed, graph_changed = self.changed, self.removed, self.graph_changed
+        self.changed = {}
+        self.removed = set()
+        self.graph_changed = False
+        self.event.clear()
+        return changed, removed, graph_changed
+
+
+class StateBroadcaster:
+    """Watches states and outputs of all Nodes, and sends the changed ones to subscribers.
+
+    There is only one watcher per process, no matter how many clients there are. Between
+    changes it costs only one cache round trip per POLL_INTERVAL. The watcher is running
+    only while there are subscribers.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        # Node ID -> {'state': ..., 'outputs': ...}
+        self.snapshot = {}
+        self._versions = None
+        self._node_ids = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self):
+        """Returns a new Subscription, and the current data of all Nodes."""
+        await self.update()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        subscription = Subscription()
+        self.subscriptions.add(subscription)
+        return subscription, dict(self.snapshot)
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    async def update(self):
+        async with self._lock:
+            await self._update()
+
+    async def _update(self):
+        versions = await cache.aget_many([graph.GRAPH_VERSION_CACHE_KEY, state.STATES_VERSION_CACHE_KEY])
+        if versions == self._versions:
+            return
+        graph_changed = self._versions is not None and \
+            versions.get(graph.GRAPH_VERSION_CACHE_KEY) != self._versions.get(graph.GRAPH_VERSION_CACHE_KEY)
+        if graph_changed or self._node_ids is None:
+            self._node_ids = await sync_to_async(list)(models.Node.objects.values_list('id', flat=True))
+        self._versions = versions
+
+        # Read all states and outputs at once
+        keys = [state.get_cache_key(node_id) for node_id in self._node_ids]
+        stored = await cache.aget_many(keys + [state.OUTPUTS_CACHE_KEY])
+        outputs = json.loads(stored.get(state.OUTPUTS_CACHE_KEY) or '{}')
+        snapshot = {
+            node_id: {
+                'state': json.loads(stored.get(state.get_cache_key(node_id)) or '{}'),
+                'outputs': outputs.get(str(node_id), {}),
+            }
+            for node_id in self._node_ids
+        }
+
+        changed = {node_id: data for node_id, data in snapshot.items() if self.snapshot.get(node_id) != data}
+        removed = [node_id for node_id in self.snapshot if node_id not in snapshot]
+        self.snapshot = snapshot
+        if changed or removed or graph_changed:
+            for subscription in self.subscriptions:
+                subscription.add(changed, removed, graph_changed)
+
+    async def _run(self):
+        try:
+            while self.subscriptions:
+                await asyncio.sleep(POLL_INTERVAL)
+                try:
+                    await self.update()
+                except Exception:
+                    logger.exception('Updating states of Nodes failed')
+        finally:
+            self._task = None
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = StateBroadcaster()
+    return _broadcaster
+
+
+async def stream_node_states():
+    """Yields Server-Sent Events about states and outputs of Nodes.
+
+    The first "snapshot" event has data of all Nodes. After that, "update" events have
+    data of only the changed Nodes, and IDs of the removed ones. "graph" events tell that
+    Nodes or Connections have been modified, and the graph should be fetched again.
+    """
+    broadcaster = get_broadcaster()
+    subscription, snapshot = await broadcaster.subscribe()
+    try:
+        yield 'retry: {}\n\n'.format(RECONNECT_DELAY * 1000)
+        yield _format_event('snapshot', {'nodes': snapshot})
+
+        end_at = time.monotonic() + MAX_STREAM_DURATION
+        while time.monotonic() < end_at:
+            try:
+                await asyncio.wait_for(subscription.event.wait(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            changed, removed, graph_changed = subscription.pop()
+            if changed or removed:
+                yield _format_event('update', {'nodes': changed, 'removed': sorted(removed)})
+            if graph_changed:
+                yield _format_event('graph', {})
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def _format_event(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
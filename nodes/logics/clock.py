@@ -1,4 +1,5 @@
-from django.utils import timezone
+import datetime
+
 from django.utils.translation import gettext_lazy, gettext as _
 
 from .. import utils
@@ -36,7 +37,7 @@ class Clock(logic.Logic):
         if not start_time or not end_time:
             return {'power': 0}
         # Check if signal should be emitted
-        local_time = timezone.now().astimezone(utils.get_configured_timezone()).strftime('%H:%M')
+        local_time = utils.now().astimezone(utils.get_configured_timezone()).strftime('%H:%M')
         if start_time < end_time:
             if start_time <= local_time and end_time > local_time:
                 return {'power': 1}
@@ -44,3 +45,27 @@ class Clock(logic.Logic):
             if start_time <= local_time or end_time > local_time:
                 return {'power': 1}
         return {'power': 0}
+
+    def get_next_change_time(self):
+        start_time = self.node.settings.get('start')
+        end_time = self.node.settings.get('end')
+        if not start_time or not end_time or start_time == end_time:
+            return None
+
+        # Find the next start and end times in the configured timezone. Those can be today or tomorrow.
+        configured_timezone = utils.get_configured_timezone()
+        local_now = utils.now().astimezone(configured_timezone)
+        next_change_times = []
+        for boundary in (start_time, end_time):
+            try:
+                boundary = datetime.time.fromisoformat(boundary)
+            except ValueError:
+                return None
+            for days in (0, 1):
+                moment = configured_timezone.localize(
+                    datetime.datetime.combine(local_now.date() + datetime.timedelta(days=days), boundary),
+                )
+                if moment > local_now:
+                    next_change_times.append(moment.timestamp())
+                    break
+        return min(next_change_times, default=None)
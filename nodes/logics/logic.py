@@ -1,5 +1,8 @@
 class Logic:
 
+    # True, if this Logic reads or controls some real device. Backtests replace these with stubs.
+    controls_devices = False
+
     def __init__(self, node):
         self.node = node
 
@@ -21,6 +24,25 @@ class Logic:
     def get_output_values(self):
         return {}
 
+    async def async_get_output_values(self):
+        """Asynchronous version of `get_output_values()`.
+
+        If a Logic implements this, then it is awaited instead of the synchronous
+        version, concurrently with other Nodes that do not depend on each other.
+        It is run in the event loop of `nodes.aio`, so it may not use the database.
+        """
+        return self.get_output_values()
+
+    def get_next_change_time(self):
+        """Returns epoch seconds of the next moment, when outputs may change even if inputs do not.
+
+        None means, that outputs change only when inputs, prices or settings change.
+        """
+        return None
+
+    def handle_tick_started(self):
+        pass
+
     def handle_inputs_changed(self, inputs):
         pass
 
@@ -33,5 +55,18 @@ class Logic:
     def apply_state_to_devices(self):
         pass
 
+    async def async_apply_state_to_devices(self):
+        """Asynchronous version of `apply_state_to_devices()`.
+
+        If a Logic implements this, then it is awaited instead of the synchronous
+        version, concurrently with the other devices. It is run in the event loop
+        of `nodes.aio`, so it may not use the database.
+        """
+        self.apply_state_to_devices()
+
     def get_settings_errors(self, settings):
         return {}
+
+    def implements(self, hook_name):
+        """Returns True, if the class of this Logic implements the given hook itself."""
+        return getattr(type(self), hook_name) is not getattr(Logic, hook_name)
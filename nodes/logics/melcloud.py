@@ -1,16 +1,15 @@
-import aiohttp
 import asyncio
-import pymelcloud
 
 from django.utils.translation import gettext_lazy, gettext as _
 
 from . import logic, validators
+from .. import aio
 
 
-# TODO: It would be great if this could combine API calls of all heat pumps.
-# Now it makes full calls all the time when single pump is read or written.
 class MelCloud(logic.Logic):
 
+    controls_devices = True
+
     def get_name(self):
         return _('Mitsubishi air-to-air heat pump')
 
@@ -52,11 +51,13 @@ class MelCloud(logic.Logic):
         return {'room temperature', 'target temperature'}
 
     def get_output_values(self):
+        return aio.run(self.async_get_output_values())
+
+    async def async_get_output_values(self):
 
         # Use local caching
         if not hasattr(self, '_cached_room_temp') or not hasattr(self, '_cached_target_temp'):
-            loop = asyncio.get_event_loop()
-            device_state = loop.run_until_complete(self._get_device_state())
+            device_state = await self._get_device_state()
             self._cached_room_temp = device_state['room_temp']
             self._cached_target_temp = device_state['target_temp']
 
@@ -65,10 +66,22 @@ class MelCloud(logic.Logic):
             'target temperature': self._cached_target_temp,
         }
 
+    def handle_tick_started(self):
+        # Forget temperatures of the previous round
+        if hasattr(self, '_cached_room_temp'):
+            del self._cached_room_temp
+        if hasattr(self, '_cached_target_temp'):
+            del self._cached_target_temp
+        # Accounts live in the event loop, so their lists of devices are forgotten there too
+        aio.get_loop().call_soon_threadsafe(MelCloudAccount.forget_devices, self.node.settings.get('username'))
+
     def handle_inputs_changed(self, inputs):
         self.node.set_state({'power': inputs.get('power')})
 
     def apply_state_to_devices(self):
+        aio.run(self.async_apply_state_to_devices())
+
+    async def async_apply_state_to_devices(self):
         # Get state
         power = self.node.get_state().get('power')
         # None means, do nothing
@@ -80,8 +93,7 @@ class MelCloud(logic.Logic):
         else:
             target_temp = self.node.settings.get('temp_off') or 20
         # Do the magic
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self._set_target_temp(target_temp))
+        await self._set_target_temp(target_temp)
 
     def get_settings_errors(self, settings, instance=None):
         settings_error = {}
@@ -113,51 +125,110 @@ class MelCloud(logic.Logic):
         return settings_error
 
     async def _get_device_state(self):
-
-        async with aiohttp.ClientSession() as session:
-            token = await pymelcloud.login(
-                self.node.settings.get('username'),
-                self.node.settings.get('password'),
-                session=session,
-            )
-
-            room_temp = None
-            target_temp = None
-
-            # Iterate all devices and try to find the one with correct name
-            devices = await pymelcloud.get_devices(token, session=session)
-            for device in devices[pymelcloud.DEVICE_TYPE_ATA]:
-                if device.name.lower() == (self.node.settings.get('name') or '').lower():
-                    room_temp = device.get_device_prop('RoomTemperature')
-                    target_temp = device.get_device_prop('SetTemperature')
-
-            await session.close()
-
+        account = MelCloudAccount.get(self.node.settings.get('username'), self.node.settings.get('password'))
+        device = await account.get_device(self.node.settings.get('name') or '')
+        if not device:
             return {
-                'room_temp': room_temp,
-                'target_temp': target_temp,
+                'room_temp': None,
+                'target_temp': None,
             }
+        return {
+            'room_temp': device.get_device_prop('RoomTemperature'),
+            'target_temp': device.get_device_prop('SetTemperature'),
+        }
 
     async def _set_target_temp(self, target_temp):
         target_temp = min(31, max(16, int(target_temp)))
-
-        async with aiohttp.ClientSession() as session:
-            token = await pymelcloud.login(
-                self.node.settings.get('username'),
-                self.node.settings.get('password'),
-                session=session,
-            )
-
-            # Update first device with matching name
-            devices = await pymelcloud.get_devices(token, session=session)
-            for device in devices[pymelcloud.DEVICE_TYPE_ATA]:
-                if device.name.lower() == (self.node.settings.get('name') or '').lower():
-
-                    # Only update if power state differs
-                    if target_temp != int(device.get_device_prop('SetTemperature') or 0):
-                        await device.update()
-                        await device.set({'target_temperature': target_temp})
-
-                    break
-
-            await session.close()
+        account = MelCloudAccount.get(self.node.settings.get('username'), self.node.settings.get('password'))
+        await account.set_target_temp(self.node.settings.get('name') or '', target_temp)
+
+
+class MelCloudAccount:
+    """Connection to MELCloud that is shared by all heat pumps of the same account.
+
+    The account keeps its login token and aiohttp session open, and the list of
+    devices is fetched only once per tick, no matter how many heat pumps are read
+    or written. Logics forget the list when a tick starts. Writes to the devices
+    of the account are done one at a time, because MELCloud limits the rate of
+    requests heavily.
+
+    Accounts live in the event loop of `nodes.aio`, so they may only be used there.
+    """
+
+    _accounts = {}
+
+    @classmethod
+    def get(cls, username, password):
+        account = cls._accounts.get(username)
+        if account is None or account.password != password:
+            if account is not None:
+                # Password has changed, so the old session is not needed any more
+                asyncio.ensure_future(account.close())
+            account = cls(username, password)
+            cls._accounts[username] = account
+        return account
+
+    @classmethod
+    def forget_devices(cls, username):
+        account = cls._accounts.get(username)
+        if account is not None:
+            account._devices = None
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self._session = None
+        self._token = None
+        self._devices = None
+        self._devices_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    async def get_device(self, name):
+        for device in await self.get_devices():
+            if device.name.lower() == name.lower():
+                return device
+        return None
+
+    async def get_devices(self):
+        async with self._devices_lock:
+            if self._devices is None:
+                self._devices = await self._fetch_devices()
+            return self._devices
+
+    async def set_target_temp(self, name, target_temp):
+        async with self._write_lock:
+            device = await self.get_device(name)
+            if not device:
+                return
+            # Only update if target temperature differs
+            if target_temp != int(device.get_device_prop('SetTemperature') or 0):
+                await device.update()
+                await device.set({'target_temperature': target_temp})
+
+    async def close(self):
+        # Wait until nobody is using the session
+        async with self._write_lock, self._devices_lock:
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+
+    async def _fetch_devices(self):
+        # These are imported only here, because they are slow to import and needed only by the periodic tasks
+        import aiohttp
+        import pymelcloud
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+
+        if self._token is None:
+            self._token = await pymelcloud.login(self.username, self.password, session=self._session)
+
+        try:
+            devices = await pymelcloud.get_devices(self._token, session=self._session)
+        except aiohttp.ClientResponseError as err:
+            if err.status != 401:
+                raise
+            # Token has expired, so log in again
+            self._token = await pymelcloud.login(self.username, self.password, session=self._session)
+            devices = await pymelcloud.get_devices(self._token, session=self._session)
+
+        return devices[pymelcloud.DEVICE_TYPE_ATA]
@@ -1,17 +1,18 @@
-import dateutil.parser
-import decimal
+import collections
 
-from django.utils import timezone
 from django.utils.translation import gettext_lazy, gettext as _
 
 from . import logic
-from .. import prices as prices_module
+from .. import prices as prices_module, schedule, utils
 
 
 # TODO: There is a problem, that if you put certain difficult min on/off times, it will not be able
 # to calculate the ranges very far, and the ranges might end before the time reaches their end
 class PriceBasedOnOff(logic.Logic):
 
+    # Ranges of the state as a Schedule, so they don't need to be parsed on every call
+    _ranges = None
+
     def get_name(self):
         return _('Price based on/off')
 
@@ -52,19 +53,24 @@ class PriceBasedOnOff(logic.Logic):
 
     def get_output_values(self):
         # If there are no ranges at all, then return True
-        ranges = self.node.get_state().get('ranges', [])
+        ranges = self._get_ranges()
         if not ranges:
             return {'power': True}
 
         # Try to find the current range
-        for start, end, state in ranges:
-            start = dateutil.parser.parse(start)
-            end = dateutil.parser.parse(end)
-            if start <= timezone.now() <= end:
-                return {'power': state}
+        current_range = ranges.get_interval_at(utils.now().timestamp())
+        if current_range:
+            return {'power': current_range[2]}
 
         # If range was not found, then return opposite what the latest range said
-        return {'power': not ranges[-1][2]}
+        return {'power': not ranges.get_last()[2]}
+
+    def get_next_change_time(self):
+        return self._get_ranges().get_next_change_time(utils.now().timestamp())
+
+    def handle_tick_started(self):
+        # Ranges are parsed from the state again, because they may have been changed by another process
+        self._ranges = None
 
     def handle_updated_prices(self, prices):
 
@@ -78,45 +84,38 @@ class PriceBasedOnOff(logic.Logic):
 
         # Get current ranges and remove those that are one week to the
         # past. The period of one week is left for debugging purposes.
-        ranges = [
-            (dateutil.parser.parse(start), dateutil.parser.parse(end), state)
-            for start, end, state in self.node.get_state().get('ranges', [])
-            if dateutil.parser.parse(end) >= timezone.now() - timezone.timedelta(days=7)
-        ]
+        now = int(utils.now().timestamp())
+        ranges = self._get_ranges().without_ended_before(now - 7 * 24 * 60 * 60)
 
         # Decide the starting point and what is the initial state of the output
-        now_hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        now_period = now - (now - prices.start) % prices.resolution
         initial_state = True
-        if ranges:
-            now_hour = max(now_hour, ranges[-1][1])
-            initial_state = not ranges[-1][2]
+        last_range = ranges.get_last()
+        if last_range:
+            now_period = max(now_period, last_range[1])
+            initial_state = not last_range[2]
 
-        # Gather the prices starting from "now_hour"
-        future_prices = [price for price in prices if price['end'] > now_hour]
+        # Gather the prices starting from "now_period"
+        future_prices = prices.slice(max(0, prices.index_at(now_period)))
 
-        # Start iterating different combinations through, and keep track of the cheapest one
-        cheapest_comb = {
-            'ranges': None,
-            'price': None,
-        }
-        self._iterate_all_combinations(
-            cheapest_comb,
+        # Find the cheapest combination of ranges. Lengths of the ranges are given as periods of the prices.
+        periods_per_hour = 3600 / prices.resolution
+        cheapest_ranges = self._find_cheapest_ranges(
             future_prices,
-            [],
-            decimal.Decimal(0),
             initial_state,
-            min_on_hours,
-            max_on_hours,
-            min_off_hours,
-            max_off_hours,
+            max(1, round(min_on_hours * periods_per_hour)),
+            max(1, round(max_on_hours * periods_per_hour)),
+            max(1, round(min_off_hours * periods_per_hour)),
+            max(1, round(max_off_hours * periods_per_hour)),
         )
-        if cheapest_comb['ranges']:
-            ranges += cheapest_comb['ranges']
+        if cheapest_ranges:
+            ranges = ranges.with_added(
+                (int(start.timestamp()), int(end.timestamp()), range_state)
+                for start, end, range_state in cheapest_ranges
+            )
 
         # Store ranges to state
-        state = self.node.get_state()
-        state['ranges'] = [(start.isoformat(), end.isoformat(), range_state) for start, end, range_state in ranges]
-        self.node.set_state(state)
+        self._set_ranges(ranges)
 
     def handle_updated_settings(self, old_settings, new_settings):
 
@@ -126,9 +125,7 @@ class PriceBasedOnOff(logic.Logic):
 
         # Remove all current ranges
         # TODO: It would be nice if only current and the future ranges would be removed!
-        state = self.node.get_state()
-        state['ranges'] = []
-        self.node.set_state(state)
+        self._set_ranges(schedule.Schedule())
 
         # Run the same function that is run when prices are updated.
         prices = prices_module.get_from_cache()
@@ -196,62 +193,95 @@ class PriceBasedOnOff(logic.Logic):
 
         return settings_error
 
-    def _iterate_all_combinations(self, cheapest_comb, prices, ranges_now, price_now, next_state,
-            min_on, max_on, min_off, max_off):
+    def _get_ranges(self):
+        """Returns the ranges as a Schedule. They are parsed from the state only once per round."""
+        if self._ranges is None:
+            self._ranges = schedule.Schedule.from_state(self.node.get_state().get('ranges', []))
+        return self._ranges
 
-        if next_state:
-            range_min = min_on
-            range_max = max_on
-        else:
-            range_min = min_off
-            range_max = max_off
-
-        # If the last state fitted perfectly, or if this change will not fit at
-        # all, then calculate price and check if it's the new cheapest one.
-        if not prices or len(prices) < range_min:
-            # If there are no ranges currently, then it means the old ranges already fill the hours. So give up.
-            if not ranges_now:
-                return
-
-            hours = round((ranges_now[-1][1] - ranges_now[0][0]).total_seconds() / 3600)
-            # If this range doesn't fit here, then add it partially,
-            # but only use this partial range in price calculation
-            if len(prices) < range_min:
-                hours += len(prices)
-                if next_state:
-                    price_now += sum([price['price'] for price in prices])
-
-            # Now calculate and compare final prices
-            price_per_hour = price_now / hours
-            if cheapest_comb['price'] is None or price_per_hour < cheapest_comb['price']:
-                cheapest_comb['price'] = price_per_hour
-                cheapest_comb['ranges'] = ranges_now
-            return
+    def _set_ranges(self, ranges):
+        self._ranges = ranges
+        state = self.node.get_state()
+        state['ranges'] = ranges.to_state()
+        self.node.set_state(state)
 
-        for new_range_len in range(range_min, range_max + 1):
-            # If the next range doesn't fit, then give up totally
-            if len(prices) < new_range_len:
-                return
-
-            # Calculate new price.
-            new_price = price_now
-            if next_state:
-                new_price += sum([price['price'] for price in prices[0:new_range_len]])
-
-            # Since the prices are now used, they can be ditched
-            new_prices = prices[new_range_len:]
-
-            # Add new ranges
-            new_ranges = ranges_now + [(prices[0]['start'], prices[new_range_len - 1]['end'], next_state)]
-
-            self._iterate_all_combinations(
-                cheapest_comb,
-                new_prices,
-                new_ranges,
-                new_price,
-                not next_state,
-                min_on,
-                max_on,
-                min_off,
-                max_off,
-            )
+    def _find_cheapest_ranges(self, prices, initial_state, min_on, max_on, min_off, max_off):
+        """Finds alternating on/off ranges that fill the given PriceSeries with the lowest price.
+
+        Minimum and maximum lengths of the ranges are given as periods of the PriceSeries.
+        Periods that are left over at the end, because they are too few for a full range,
+        get the next state without a range of their own. The result is the same as when
+        trying out every combination, and if there are several cheapest ones, then the one
+        with the shortest ranges at the beginning is selected.
+
+        This is done with dynamic programming from the last period towards the first one.
+        Possible ends of the next range form a sliding window, and the cheapest end in it
+        is kept at the front of a monotonic queue, so the whole search takes O(periods)
+        time, no matter how long the ranges can be. Returns None if not even one range fits.
+        """
+        periods = len(prices)
+
+        # Prefix sums, so the price of any range can be calculated in constant time.
+        # Prices are integers, so the sums are exact and ties can be detected.
+        prefix_sums = prices.get_prefix_sums().tolist()
+
+        limits = {
+            True: (min_on, max_on),
+            False: (min_off, max_off),
+        }
+
+        # For both states, and for every period, the cheapest price of the periods from that
+        # period onwards, when the next range has that state, and the length of that range.
+        # Zero length means, that the rest of the periods do not fit a full range.
+        cheapest_prices = {True: [0] * (periods + 1), False: [0] * (periods + 1)}
+        range_lengths = {True: [0] * (periods + 1), False: [0] * (periods + 1)}
+
+        # For both states, possible ends of the next range as (end, price) pairs. The price is the
+        # cheapest price from the end onwards, plus for "on" ranges the prefix sum at the end, so
+        # that the prefix sum at the start can be subtracted later. Ends are in descending order
+        # and prices in ascending order, so the cheapest end is always the first one.
+        range_ends = {True: collections.deque(), False: collections.deque()}
+
+        for period in range(periods, -1, -1):
+            for state in (True, False):
+                range_min, range_max = limits[state]
+
+                # If the range doesn't fit here, then the rest of the periods get this state partially
+                if periods - period < range_min:
+                    if state:
+                        cheapest_prices[state][period] = prefix_sums[periods] - prefix_sums[period]
+                    continue
+
+                # The shortest range from here adds a new end. Ends that are not cheaper than it can
+                # never be selected anymore, because it is shorter, and it stays in the window longer.
+                ends = range_ends[state]
+                end = period + range_min
+                end_price = cheapest_prices[not state][end]
+                if state:
+                    end_price += prefix_sums[end]
+                while ends and ends[-1][1] >= end_price:
+                    ends.pop()
+                ends.append((end, end_price))
+
+                # Remove ends that are too far for the longest range
+                while ends[0][0] > period + range_max:
+                    ends.popleft()
+
+                end, end_price = ends[0]
+                cheapest_prices[state][period] = end_price - prefix_sums[period] if state else end_price
+                range_lengths[state][period] = end - period
+
+        # If not even the first range fits, then the old ranges already fill the periods
+        if range_lengths[initial_state][0] == 0:
+            return None
+
+        # Follow the cheapest ranges from the first period
+        ranges = []
+        period = 0
+        state = initial_state
+        while range_lengths[state][period]:
+            range_len = range_lengths[state][period]
+            ranges.append((prices.get_start_datetime(period), prices.get_end_datetime(period + range_len - 1), state))
+            period += range_len
+            state = not state
+        return ranges
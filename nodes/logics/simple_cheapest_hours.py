@@ -1,10 +1,7 @@
-import dateutil
-import decimal
-
-from django.utils import timezone
 from django.utils.translation import gettext_lazy, gettext as _
 
 from . import logic
+from .. import schedule, utils
 
 
 class SimpleCheapestHours(logic.Logic):
@@ -12,6 +9,9 @@ class SimpleCheapestHours(logic.Logic):
     DEFAULT_ON_HOURS = 4
     DEFAULT_MIN_OFF_HOURS = 12
 
+    # Hours of the state as a Schedule, so they don't need to be parsed on every call
+    _hours = None
+
     def get_name(self):
         return _('Simple cheapest hours')
 
@@ -38,73 +38,63 @@ class SimpleCheapestHours(logic.Logic):
         return {'power'}
 
     def get_output_values(self):
-        # Check all hours. If any of them is now, then return active signal
         # Return active signal, if any of the hours is now
-        for start, end in self.node.get_state().get('hours', []):
-            start = dateutil.parser.parse(start)
-            end = dateutil.parser.parse(end)
-            if start <= timezone.now() <= end:
-                return {'power': 1}
+        if self._get_hours().get_index_at(utils.now().timestamp()) is not None:
+            return {'power': 1}
         return {'power': 0}
 
+    def get_next_change_time(self):
+        return self._get_hours().get_next_change_time(utils.now().timestamp())
+
+    def handle_tick_started(self):
+        # Hours are parsed from the state again, because they may have been changed by another process
+        self._hours = None
+
     def handle_updated_prices(self, prices):
+        # This is imported only here, because it is slow to import and needed only by the periodic tasks
+        import numpy
 
         # Get options for this node
-        on_hours = self.node.settings.get('on_hours', SimpleCheapestHours.DEFAULT_ON_HOURS)
-        on_hours_td = timezone.timedelta(hours=on_hours)
-        min_off_hours_td = timezone.timedelta(
-            hours=self.node.settings.get('min_off_hours', SimpleCheapestHours.DEFAULT_MIN_OFF_HOURS),
-        )
+        on_seconds = self.node.settings.get('on_hours', SimpleCheapestHours.DEFAULT_ON_HOURS) * 60 * 60
+        min_off_seconds = self.node.settings.get('min_off_hours', SimpleCheapestHours.DEFAULT_MIN_OFF_HOURS) * 60 * 60
 
         # Get current hours and remove those that are one week to the
         # past. The period of one week is left for debugging purposes.
-        hours = [
-            (dateutil.parser.parse(start), dateutil.parser.parse(end))
-            for start, end in self.node.get_state().get('hours', [])
-            if dateutil.parser.parse(end) >= timezone.now() - timezone.timedelta(days=7)
-        ]
+        now = int(utils.now().timestamp())
+        hours = self._get_hours().without_ended_before(now - 7 * 24 * 60 * 60)
+
+        # Prices may have shorter periods than an hour, so convert hours to periods
+        day_periods = 24 * 3600 // prices.resolution
+        on_periods = max(1, on_seconds // prices.resolution)
 
         # If there are already on-hours during the last 24 hours, then don't add more on-hours
-        range_24h_start = prices[-24]['start']
-        for start, end in hours:
-            if end > range_24h_start:
-                return
-
-        # Now try to find a good on time for the newest 24 hour range
-        prices = prices[-23 - on_hours:]
-        best_on_time_price_ofs = None
-        best_on_time_total_price = None
-        for price_ofs in range(len(prices)):
-            # Skip those hours that start in the past
-            if prices[price_ofs]['start'] < timezone.now():
-                continue
-            # Give up if there is not enough hours to fit the on_hours range
-            if len(prices) - price_ofs < on_hours:
-                break
-            # Skip if this time is too close to already existing on_hour range
-            price_start = prices[price_ofs]['start']
-            price_end = price_start + on_hours_td
-            too_close = False
-            for hour_start, hour_end in hours:
-                if price_start < hour_end + min_off_hours_td and price_end > hour_start - min_off_hours_td:
-                    too_close = True
-                    break
-            if too_close:
-                continue
-            # Check if this would be a better candidate
-            total_price = decimal.Decimal(0)
-            for hour_i in range(on_hours):
-                total_price += prices[price_ofs + hour_i]['price']
-            if best_on_time_total_price is None or best_on_time_total_price > total_price:
-                best_on_time_price_ofs = price_ofs
-                best_on_time_total_price = total_price
-        # If good price was found
-        if best_on_time_total_price is not None:
-            best_on_time_price_start = prices[best_on_time_price_ofs]['start']
-            hours.append((best_on_time_price_start, best_on_time_price_start + on_hours_td))
+        if len(prices) < day_periods:
+            return
+        last_hours = hours.get_last()
+        if last_hours and last_hours[1] > prices.get_period_start(len(prices) - day_periods):
+            return
+
+        # Now try to find a good on time for the newest 24 hour range. Calculate total prices of all
+        # on-ranges that fit the periods, and then rule out those that cannot be used.
+        prices = prices.slice(-(day_periods - 1 + on_periods))
+        total_prices = prices.get_window_sums(on_periods)
+        range_starts = prices.get_starts()[:len(total_prices)]
+        range_ends = range_starts + on_seconds
+        # Skip those hours that start in the past
+        usable = range_starts >= now
+        # Skip if this time is too close to already existing on_hour range
+        for hour_start, hour_end, value in hours.intervals:
+            usable &= (range_starts >= hour_end + min_off_seconds) | (range_ends <= hour_start - min_off_seconds)
+        # If good price was found, then pick the cheapest one. If there are many, pick the first one.
+        usable_indices = numpy.flatnonzero(usable)
+        if len(usable_indices):
+            best_on_time_price_ofs = usable_indices[numpy.argmin(total_prices[usable_indices])]
+            best_on_time_price_start = prices.get_period_start(int(best_on_time_price_ofs))
+            hours = hours.with_added([(best_on_time_price_start, best_on_time_price_start + on_seconds, True)])
 
         # Store new state of node
-        self.node.set_state({'hours': [(start.isoformat(), end.isoformat()) for start, end in hours]})
+        self._hours = hours
+        self.node.set_state({'hours': hours.to_state(with_values=False)})
 
     def get_settings_errors(self, settings):
         settings_error = {}
@@ -135,3 +125,9 @@ class SimpleCheapestHours(logic.Logic):
                 settings_error['min_off_hours'] = [_('Must be smaller than {}!'.format(24 - min(23, on_hours)))]
 
         return settings_error
+
+    def _get_hours(self):
+        """Returns the hours as a Schedule. They are parsed from the state only once per round."""
+        if self._hours is None:
+            self._hours = schedule.Schedule.from_state(self.node.get_state().get('hours', []), True)
+        return self._hours
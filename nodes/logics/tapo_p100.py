@@ -1,8 +1,7 @@
 from django.utils.translation import gettext_lazy, gettext as _
 
 import logging
-from PyP100 import PyP100
-import requests.exceptions
+import threading
 
 from . import logic, validators
 
@@ -10,8 +9,14 @@ from . import logic, validators
 logger = logging.getLogger(__name__)
 
 
+# Seconds to wait for a smartplug. PyP100 gives a timeout only to some of its requests.
+REQUEST_TIMEOUT = 2
+
+
 class TapoP100(logic.Logic):
 
+    controls_devices = True
+
     def get_name(self):
         return _('Tapo P100')
 
@@ -41,6 +46,9 @@ class TapoP100(logic.Logic):
         self.node.set_state({'power': inputs.get('power')})
 
     def apply_state_to_devices(self):
+        # This is imported only here, because it is needed only by the periodic tasks
+        import requests.exceptions
+
         # Get and parse state
         power = self.node.get_state().get('power')
         # None means, do nothing
@@ -53,17 +61,22 @@ class TapoP100(logic.Logic):
         ip = self.node.settings.get('ip')
         username = self.node.settings.get('username')
         password = self.node.settings.get('password')
-        try:
-            # Establish connection
-            p100 = PyP100.P100(ip, username, password)
-            p100.handshake()
-            p100.login()
-            # Update state
+
+        def update_state(p100):
+            # Read the current state first, so the plug is not switched needlessly
+            device_info = p100.getDeviceInfo()
+            if device_info.get('error_code') != 0:
+                raise Exception('Error Code: {}'.format(device_info.get('error_code')))
+            if device_info['result'].get('device_on') == power:
+                return
             if power:
                 p100.turnOn()
             else:
                 p100.turnOff()
-        except requests.exceptions.ConnectTimeout:
+
+        try:
+            session_pool.run(ip, username, password, update_state)
+        except requests.exceptions.Timeout:
             logger.error('Unable to connect to Tapo smartplug at {}'.format(ip))
 
     def get_settings_errors(self, settings, instance=None):
@@ -99,3 +112,77 @@ class TapoP100(logic.Logic):
                 settings_error['password'] = [_('Invalid type!')]
 
         return settings_error
+
+
+class TapoSessionPool:
+    """Keeps authenticated sessions to Tapo smartplugs between ticks.
+
+    Creating a session needs a new RSA key, a handshake and a login, so they are
+    done only when there is no session yet, or when the old one stops working.
+    """
+
+    def __init__(self):
+        # (IP address, username) -> PyP100.P100
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def run(self, ip, username, password, func):
+        """Calls `func` with an authenticated PyP100.P100 and returns its result.
+
+        If `func` fails with a reused session, then the session has probably
+        expired, so a new session is created and `func` is called once again.
+        Timeouts are not retried, because then the smartplug is not reachable.
+        """
+        # This is imported only here, because it is needed only by the periodic tasks
+        import requests.exceptions
+
+        key = (ip, username)
+
+        # Take the session out of the pool while using it, so two threads never share it
+        with self._lock:
+            p100 = self._sessions.pop(key, None)
+        if p100 is not None and p100.password != password:
+            p100 = None
+
+        if p100 is None:
+            p100 = self._connect(ip, username, password)
+            result = func(p100)
+        else:
+            try:
+                result = func(p100)
+            except requests.exceptions.Timeout:
+                raise
+            except Exception:
+                logger.info('Session to Tapo smartplug at {} stopped working, creating a new one'.format(ip))
+                p100 = self._connect(ip, username, password)
+                result = func(p100)
+
+        with self._lock:
+            self._sessions[key] = p100
+
+        return result
+
+    def _connect(self, ip, username, password):
+        # This is imported only here, because it is slow to import and needed only by the periodic tasks
+        from PyP100 import PyP100
+
+        p100 = PyP100.P100(ip, username, password)
+        _set_default_timeout(p100.session, REQUEST_TIMEOUT)
+        p100.handshake()
+        p100.login()
+        return p100
+
+
+def _set_default_timeout(session, timeout):
+    # Requests that are made without a timeout would wait forever for an unreachable smartplug,
+    # and keep their worker thread even after the tick has stopped waiting for them.
+    request = session.request
+
+    def request_with_timeout(*args, **kwargs):
+        kwargs.setdefault('timeout', timeout)
+        return request(*args, **kwargs)
+
+    session.request = request_with_timeout
+
+
+session_pool = TapoSessionPool()
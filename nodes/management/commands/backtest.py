@@ -0,0 +1,81 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import backtest, utils
+
+
+class Command(BaseCommand):
+    help = ('Replays stored price history through the current Nodes with simulated time, and reports '
+            'how many hours every on/off output was on, and how much that would have cost. '
+            'Devices are not controlled.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start',
+            type=datetime.date.fromisoformat,
+            help='First day of the backtest, as YYYY-MM-DD. Defaults to one year before the end.',
+        )
+        parser.add_argument(
+            '--end',
+            type=datetime.date.fromisoformat,
+            help='Day after the last day of the backtest, as YYYY-MM-DD. Defaults to today.',
+        )
+        parser.add_argument(
+            '--area',
+            help='Price area. Defaults to the area of the selected country.',
+        )
+        parser.add_argument(
+            '--load-kw',
+            type=float,
+            default=1,
+            help='Power of the load that every output is assumed to control, in kilowatts.',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the results as JSON.',
+        )
+
+    def handle(self, *args, **options):
+        # Days start at midnight of the configured timezone
+        configured_timezone = utils.get_configured_timezone()
+        end_date = options['end'] or utils.now().astimezone(configured_timezone).date()
+        start_date = options['start'] or end_date - datetime.timedelta(days=365)
+        if start_date >= end_date:
+            raise CommandError('Start must be before end!')
+        start = configured_timezone.localize(datetime.datetime.combine(start_date, datetime.time()))
+        end = configured_timezone.localize(datetime.datetime.combine(end_date, datetime.time()))
+
+        try:
+            result = backtest.run_backtest(start, end, area=options['area'], load_kw=options['load_kw'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if options['json']:
+            self.stdout.write(json.dumps(result.to_dict(), indent=2))
+            return
+
+        self.stdout.write('Backtest from {} to {}, {} rounds in {:.2f} s'.format(
+            start_date,
+            end_date,
+            result.rounds,
+            result.duration,
+        ))
+        if result.average_price is None:
+            self.stdout.write('There are no prices for this time.')
+            return
+        self.stdout.write('Average price {:.2f}'.format(result.average_price))
+
+        self.stdout.write('{:<30} {:<20} {:>10} {:>12} {:>12}'.format(
+            'node', 'output', 'hours on', 'cost', 'avg price',
+        ))
+        for output in result.outputs:
+            self.stdout.write('{:<30} {:<20} {:>10.1f} {:>12.2f} {:>12}'.format(
+                output['name'][:30],
+                output['output'][:20],
+                output['hours_on'],
+                output['cost'],
+                '-' if output['average_price'] is None else '{:.2f}'.format(output['average_price']),
+            ))
@@ -0,0 +1,152 @@
+import decimal
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ... import price_series
+from ...logics import price_based_on_off
+
+
+class Command(BaseCommand):
+    help = ('Compares the optimizer of PriceBasedOnOff to trying out every combination of ranges. '
+            'Checks that both give the same ranges, and reports how long they take.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=16,
+            help='How many hours of prices to optimize. Trying out every combination gets very slow after 20.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for random prices.',
+        )
+        parser.add_argument(
+            '--step',
+            type=int,
+            default=3,
+            help='Step between tested minimum and maximum lengths of ranges.',
+        )
+
+    def handle(self, *args, **options):
+        hours = options['hours']
+        if hours < 1:
+            raise CommandError('There must be at least one hour!')
+
+        # Random prices with some negative ones. The original algorithm uses a list of dicts.
+        rand = random.Random(options['seed'])
+        start = int(timezone.now().timestamp()) // 3600 * 3600
+        prices = price_series.PriceSeries(start, 3600, [rand.randint(-5000, 300000) for hour in range(hours)])
+        prices_dicts = [
+            {
+                'start': prices.get_start_datetime(hour),
+                'end': prices.get_end_datetime(hour),
+                'price': price_series.from_fixed_point(price),
+            }
+            for hour, price in enumerate(prices.prices)
+        ]
+
+        logic = price_based_on_off.PriceBasedOnOff(None)
+        lengths = range(1, 24, options['step'])
+        total_exhaustive = 0
+        total_optimizer = 0
+        mismatches = 0
+
+        self.stdout.write('{:>6} {:>6} {:>7} {:>7} {:>14} {:>14}'.format(
+            'on', 'off', 'state', 'same', 'exhaustive ms', 'optimizer ms',
+        ))
+
+        for min_on, max_on, min_off, max_off in itertools.product(lengths, repeat=4):
+            if min_on > max_on or min_off > max_off:
+                continue
+            for initial_state in (True, False):
+                started_at = time.perf_counter()
+                exhaustive_ranges = _try_all_combinations(prices_dicts, initial_state, min_on, max_on, min_off, max_off)
+                exhaustive_duration = time.perf_counter() - started_at
+
+                started_at = time.perf_counter()
+                optimizer_ranges = logic._find_cheapest_ranges(prices, initial_state, min_on, max_on, min_off, max_off)
+                optimizer_duration = time.perf_counter() - started_at
+
+                same = exhaustive_ranges == optimizer_ranges
+                if not same:
+                    mismatches += 1
+                total_exhaustive += exhaustive_duration
+                total_optimizer += optimizer_duration
+
+                self.stdout.write('{:>6} {:>6} {:>7} {:>7} {:>14.3f} {:>14.3f}'.format(
+                    f'{min_on}-{max_on}',
+                    f'{min_off}-{max_off}',
+                    'on' if initial_state else 'off',
+                    'yes' if same else 'NO',
+                    exhaustive_duration * 1000,
+                    optimizer_duration * 1000,
+                ))
+
+        self.stdout.write('Total: exhaustive {:.1f} ms, optimizer {:.1f} ms, speedup {:.1f}x'.format(
+            total_exhaustive * 1000,
+            total_optimizer * 1000,
+            total_exhaustive / max(total_optimizer, 1e-9),
+        ))
+        if mismatches:
+            raise CommandError(f'{mismatches} results differ!')
+
+
+def _try_all_combinations(prices, initial_state, min_on, max_on, min_off, max_off):
+    """The original algorithm of PriceBasedOnOff, that tries out every combination of ranges."""
+    cheapest_comb = {
+        'ranges': None,
+        'price': None,
+    }
+    _iterate_all_combinations(
+        cheapest_comb, prices, [], decimal.Decimal(0), initial_state, min_on, max_on, min_off, max_off,
+    )
+    return cheapest_comb['ranges']
+
+
+def _iterate_all_combinations(cheapest_comb, prices, ranges_now, price_now, next_state,
+        min_on, max_on, min_off, max_off):
+
+    if next_state:
+        range_min = min_on
+        range_max = max_on
+    else:
+        range_min = min_off
+        range_max = max_off
+
+    if not prices or len(prices) < range_min:
+        if not ranges_now:
+            return
+
+        hours = round((ranges_now[-1][1] - ranges_now[0][0]).total_seconds() / 3600)
+        if len(prices) < range_min:
+            hours += len(prices)
+            if next_state:
+                price_now += sum([price['price'] for price in prices])
+
+        price_per_hour = price_now / hours
+        if cheapest_comb['price'] is None or price_per_hour < cheapest_comb['price']:
+            cheapest_comb['price'] = price_per_hour
+            cheapest_comb['ranges'] = ranges_now
+        return
+
+    for new_range_len in range(range_min, range_max + 1):
+        if len(prices) < new_range_len:
+            return
+
+        new_price = price_now
+        if next_state:
+            new_price += sum([price['price'] for price in prices[0:new_range_len]])
+
+        new_prices = prices[new_range_len:]
+        new_ranges = ranges_now + [(prices[0]['start'], prices[new_range_len - 1]['end'], next_state)]
+
+        _iterate_all_combinations(
+            cheapest_comb, new_prices, new_ranges, new_price, not next_state, min_on, max_on, min_off, max_off,
+        )
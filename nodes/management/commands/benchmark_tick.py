@@ -0,0 +1,87 @@
+import datetime
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Runs the periodic tasks with synthetic graphs of different shapes and sizes, and reports time, '
+            'peak memory, database queries and cache round trips of every round. Memcached and devices '
+            'are replaced with in-memory stand-ins.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='10,100,1000,10000',
+            help='Comma separated numbers of Nodes. Sizes up to 100000 work, but take a while.',
+        )
+        parser.add_argument(
+            '--shapes',
+            default=','.join(benchmark.SHAPES),
+            help='Comma separated shapes of the graphs: {}.'.format(', '.join(benchmark.SHAPES)),
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=5,
+            help='How many rounds to measure after the first one.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for random graphs and prices.',
+        )
+        parser.add_argument(
+            '--output',
+            default='benchmark_tick.json',
+            help='JSON file where the results are written.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes must be integers!')
+        if any(size < 1 for size in sizes):
+            raise CommandError('There must be at least one Node!')
+        shapes = options['shapes'].split(',')
+        for shape in shapes:
+            if shape not in benchmark.SHAPES:
+                raise CommandError(f'Unknown shape {shape}!')
+        if options['rounds'] < 1:
+            raise CommandError('There must be at least one round!')
+
+        self.stdout.write('{:<8} {:>7} {:>11} {:>11} {:>9} {:>9} {:>10}'.format(
+            'shape', 'nodes', 'first ms', 'median ms', 'queries', 'cache', 'peak KiB',
+        ))
+
+        results = []
+        for shape in shapes:
+            for size in sizes:
+                result = benchmark.run_benchmark(shape, size, rounds=options['rounds'], seed=options['seed'])
+                results.append(result)
+                self.stdout.write('{:<8} {:>7} {:>11.2f} {:>11.2f} {:>9} {:>9} {:>10.0f}'.format(
+                    shape,
+                    size,
+                    result['first_round']['seconds'] * 1000,
+                    result['rounds']['median_seconds'] * 1000,
+                    result['rounds']['queries'],
+                    result['rounds']['cache_round_trips'],
+                    result['peak_memory_bytes'] / 1024,
+                ))
+
+        with open(options['output'], 'w') as output_file:
+            json.dump({
+                'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'rounds': options['rounds'],
+                'seed': options['seed'],
+                'results': results,
+            }, output_file, indent=2)
+        self.stdout.write('Results were written to {}'.format(options['output']))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+import django_lock
+
+from ... import prices, tasks
+
+
+class Command(BaseCommand):
+    help = 'Fetches day-ahead prices that are missing, unless the previous failure was too recent.'
+
+    def handle(self, *args, **options):
+
+        try:
+            with django_lock.lock(tasks.FETCH_PRICES_LOCK_NAME, blocking=False,
+                    timeout=tasks.FETCH_PRICES_LOCK_TIMEOUT):
+                prices.fetch_prices()
+
+        except django_lock.Locked:
+            pass
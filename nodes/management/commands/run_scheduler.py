@@ -0,0 +1,127 @@
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+import django_lock
+
+from ... import prices, profiling, tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds between checks for missing prices. Most of the checks are only a look at the cache.
+FETCH_PRICES_INTERVAL = 60
+
+# Seconds between checks, if the graph, prices or Variables have been modified while sleeping
+EVENT_POLL_INTERVAL = 1
+
+# Rounds are never started more often than this, even if outputs of Nodes would change sooner
+MIN_ROUND_INTERVAL = 1
+
+
+class Command(BaseCommand):
+    help = ('Keeps running periodic tasks, and fetching prices in the background, until terminated. A round is run '
+            'when outputs of some Node change, when something is modified, or at least after the interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=300,
+            help='Maximum seconds between the starts of two rounds of periodic tasks.',
+        )
+        profiling.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        if options['profile_keep'] < 1:
+            raise CommandError('At least one profile must be kept!')
+        profiler = profiling.TickProfiler.from_options(options)
+
+        # Stop gracefully when terminated. A round that is already running is finished first.
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info('Scheduler got signal {}, stopping'.format(signum))
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        # Prices are fetched in their own thread, so a slow API never delays the periodic tasks
+        price_fetcher = threading.Thread(target=self.fetch_prices, args=(stop,), name='fetch_prices', daemon=True)
+        price_fetcher.start()
+
+        while not stop.is_set():
+            started_at = time.monotonic()
+            event_versions = None
+            next_change_time = None
+
+            try:
+                # Rounds without changes make no queries, so the connection may have been idle longer
+                # than the database allows. Replace it before it is used, instead of failing the round.
+                close_old_connections()
+
+                event_versions = tasks.get_event_versions()
+
+                # The lock is shared with `run_periodic_tasks`, so
+                # the tasks are never run by two processes at once.
+                with django_lock.lock(tasks.LOCK_NAME, blocking=False, timeout=tasks.LOCK_TIMEOUT):
+                    with profiling.profile_tick(profiler):
+                        next_change_time = tasks.run_periodic_tasks()
+            except django_lock.Locked:
+                logger.info('Periodic tasks are already running in another process')
+            except Exception:
+                logger.exception('Running periodic tasks failed')
+                # Database connections are kept open between rounds. If one
+                # of them got broken, then start over with fresh ones.
+                connections.close_all()
+
+            # Sleep until outputs of some Node change, or until the interval has passed
+            wake_at = started_at + interval
+            if next_change_time is not None:
+                wake_at = min(wake_at, time.monotonic() + next_change_time - time.time())
+            wake_at = max(wake_at, started_at + MIN_ROUND_INTERVAL)
+
+            # Wake up earlier, if something is modified meanwhile
+            while not stop.is_set():
+                remaining = wake_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                stop.wait(min(remaining, EVENT_POLL_INTERVAL))
+                new_event_versions = self.get_event_versions()
+                if event_versions is not None and new_event_versions is not None \
+                        and new_event_versions != event_versions:
+                    break
+
+        price_fetcher.join()
+
+    def get_event_versions(self):
+        try:
+            return tasks.get_event_versions()
+        except Exception:
+            logger.exception('Checking for modifications failed')
+            return None
+
+    def fetch_prices(self, stop):
+        while not stop.is_set():
+            try:
+                close_old_connections()
+                with django_lock.lock(tasks.FETCH_PRICES_LOCK_NAME, blocking=False,
+                        timeout=tasks.FETCH_PRICES_LOCK_TIMEOUT):
+                    prices.fetch_prices()
+            except django_lock.Locked:
+                pass
+            except Exception:
+                logger.exception('Fetching prices failed')
+                connections.close_all()
+
+            stop.wait(FETCH_PRICES_INTERVAL)
+
+        # Database connections of this thread are not closed automatically
+        connections.close_all()
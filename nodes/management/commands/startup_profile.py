@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Modules that are imported when a uWSGI worker or the periodic tasks start
+DEFAULT_MODULES = [
+    'epower.wsgi',
+    'nodes.tasks',
+]
+
+
+class Command(BaseCommand):
+    help = 'Reports how long importing each module takes when the project starts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--module',
+            action='append',
+            dest='modules',
+            help='Module to import. Can be given multiple times. Defaults to the WSGI app, '
+                 'the periodic tasks and all Logic classes.',
+        )
+        parser.add_argument(
+            '--sort',
+            choices=['cumulative', 'self'],
+            default='cumulative',
+            help='Which import time to sort by.',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=30,
+            help='How many of the slowest modules to show.',
+        )
+
+    def handle(self, *args, **options):
+        modules = options['modules']
+        if not modules:
+            modules = DEFAULT_MODULES + ['.'.join(path.split('.')[:-1]) for path in settings.NODE_LOGIC_CLASSES]
+
+        # Import times can only be measured in a fresh interpreter
+        code = 'import django; django.setup()\n' + ''.join(f'import {module}\n' for module in modules)
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'epower.settings')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError('Importing modules failed:\n{}'.format(result.stderr))
+
+        # Parse lines like "import time:       123 |        456 |   module.name"
+        timings = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            columns = line[len('import time:'):].split('|')
+            if len(columns) != 3 or not columns[0].strip().isdigit():
+                continue
+            timings.append((int(columns[0]), int(columns[1]), columns[2].strip()))
+
+        total_us = sum(self_us for self_us, cumulative_us, module in timings)
+        sort_column = 1 if options['sort'] == 'cumulative' else 0
+        timings.sort(key=lambda timing: timing[sort_column], reverse=True)
+
+        self.stdout.write('{:>12} {:>12}  {}'.format('self (ms)', 'cumul. (ms)', 'module'))
+        for self_us, cumulative_us, module in timings[:options['limit']]:
+            self.stdout.write('{:>12.1f} {:>12.1f}  {}'.format(self_us / 1000, cumulative_us / 1000, module))
+        self.stdout.write('Total import time of {} modules: {:.1f} ms'.format(len(timings), total_us / 1000))
@@ -0,0 +1,314 @@
+import contextlib
+import heapq
+import json
+import logging
+import threading
+import time
+
+from django.core.cache import cache, caches
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+# Metrics of the scheduler process are stored here, so the web server can serve them. The first
+# version stored every hook of every Node under "node_metrics", so this key is different.
+METRICS_CACHE_KEY = 'hook_metrics'
+METRICS_TIMEOUT = 60 * 60 * 24
+
+# How many of the slowest hooks are told in the summary of a tick
+SUMMARY_SLOWEST_HOOKS = 5
+
+# How many hooks of single Nodes, that have taken the most time in total, are published. The
+# rest are published only as sums over all Nodes, so the size of the metrics stays bounded.
+PUBLISHED_SLOWEST_NODE_HOOKS = 20
+
+# Methods of the cache, that are one round trip to the server each
+_CACHE_METHODS = ('add', 'get', 'set', 'touch', 'delete', 'get_many', 'set_many', 'delete_many', 'incr', 'decr')
+
+# Indices of the values of one hook
+CALLS, ERRORS, SECONDS, QUERIES, CACHE_ROUND_TRIPS = range(5)
+
+# The tick that is being recorded, or None
+_current_tick = None
+
+# Metrics of all ticks since the process started. (Node ID, hook) -> list of values.
+_totals = {}
+# Sums of the above over all Nodes. Hook -> list of values.
+_hook_totals = {}
+_totals_lock = threading.Lock()
+_total_ticks = 0
+_total_tick_seconds = 0.0
+# Node ID -> (name, logic class)
+_node_labels = {}
+
+
+class TickMetrics:
+    """Records durations, call counts, exceptions, database queries and cache round trips of the hooks of one tick.
+
+    Calls are only appended to a list while the tick runs, and they are added to the totals of the process
+    when the tick ends. Queries and cache round trips are counted only in the thread that runs the tick,
+    and they are attributed to the hook that is running in that thread.
+    """
+
+    def __init__(self):
+        # (Node, hook, seconds, failed) of every call
+        self.calls = []
+        self.queries = 0
+        self.cache_round_trips = 0
+        self.seconds = None
+        # Stack of the (Node, hook) that are running in each thread
+        self._local = threading.local()
+
+    def hook(self, node, hook_name):
+        return _HookTimer(self, node, hook_name)
+
+    def add(self, node, hook_name, seconds, failed=False):
+        # Appending to a list is thread safe, so no locks are needed
+        self.calls.append((node, hook_name, seconds, failed))
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        self._count_to_running_hook(QUERIES)
+        return execute(sql, params, many, context)
+
+    def count_cache_round_trip(self):
+        self.cache_round_trips += 1
+        self._count_to_running_hook(CACHE_ROUND_TRIPS)
+
+    def get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def add_to_totals(self):
+        with _totals_lock:
+            for node, hook_name, seconds, failed in self.calls:
+                for values in _get_totals(node, hook_name):
+                    values[CALLS] += 1
+                    values[SECONDS] += seconds
+                    if failed:
+                        values[ERRORS] += 1
+
+    def get_summary(self):
+        slowest = heapq.nlargest(SUMMARY_SLOWEST_HOOKS, self.calls, key=lambda call: call[2])
+        return {
+            'seconds': self.seconds,
+            'queries': self.queries,
+            'cache_round_trips': self.cache_round_trips,
+            'hook_calls': len(self.calls),
+            'hook_errors': sum(1 for call in self.calls if call[3]),
+            'slowest': [
+                {
+                    'node': node.id,
+                    'name': node.name,
+                    'hook': hook_name,
+                    'seconds': round(seconds, 6),
+                }
+                for node, hook_name, seconds, failed in slowest
+            ],
+        }
+
+    def _count_to_running_hook(self, index):
+        stack = self.get_stack()
+        if stack:
+            node, hook_name = stack[-1]
+            with _totals_lock:
+                for values in _get_totals(node, hook_name):
+                    values[index] += 1
+
+
+class _HookTimer:
+    """Context manager that times one call of a hook. This is a class, because it is faster than a generator."""
+
+    __slots__ = ('tick', 'node', 'hook_name', 'stack', 'started_at')
+
+    def __init__(self, tick, node, hook_name):
+        self.tick = tick
+        self.node = node
+        self.hook_name = hook_name
+
+    def __enter__(self):
+        self.stack = self.tick.get_stack()
+        self.stack.append((self.node, self.hook_name))
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.started_at
+        self.stack.pop()
+        self.tick.calls.append((self.node, self.hook_name, seconds, exc_type is not None))
+
+
+def hook(node, hook_name):
+    """Returns a context manager, that records a call of a hook of a Node, if a tick is being recorded."""
+    if _current_tick is None:
+        return contextlib.nullcontext()
+    return _HookTimer(_current_tick, node, hook_name)
+
+
+def add(node, hook_name, seconds, failed=False):
+    """Records a call of a hook, that has been timed elsewhere. Used for coroutines, that run concurrently."""
+    if _current_tick is not None:
+        _current_tick.add(node, hook_name, seconds, failed)
+
+
+@contextlib.contextmanager
+def record_tick():
+    """Records metrics of the hooks that are called inside this, and publishes them when the tick ends.
+
+    A summary of the tick is logged as JSON to the "nodes.metrics" logger, and the totals
+    are stored to cache, so `/api/v1/metrics/` can serve them.
+    """
+    global _current_tick
+    tick = TickMetrics()
+    _current_tick = tick
+    started_at = time.perf_counter()
+    try:
+        with connection.execute_wrapper(tick.count_query), _count_cache_round_trips(tick):
+            yield tick
+    finally:
+        tick.seconds = time.perf_counter() - started_at
+        _current_tick = None
+        try:
+            tick.add_to_totals()
+            _publish(tick)
+        except Exception:
+            logger.exception('Publishing metrics failed')
+
+
+def reset():
+    """Forgets the totals of all ticks. Used by benchmarks, so earlier graphs do not affect them."""
+    global _total_ticks, _total_tick_seconds
+    with _totals_lock:
+        _totals.clear()
+        _hook_totals.clear()
+        _node_labels.clear()
+    _total_ticks = 0
+    _total_tick_seconds = 0.0
+
+
+def get_prometheus_text():
+    """Returns the latest metrics of the scheduler in the text format of Prometheus."""
+    snapshot = cache.get(METRICS_CACHE_KEY)
+    if not snapshot:
+        return ''
+    snapshot = json.loads(snapshot)
+
+    lines = [
+        '# HELP epower_ticks_total Ticks of the periodic tasks.',
+        '# TYPE epower_ticks_total counter',
+        'epower_ticks_total {}'.format(snapshot['ticks']),
+        '# HELP epower_tick_seconds_total Time spent in the periodic tasks.',
+        '# TYPE epower_tick_seconds_total counter',
+        'epower_tick_seconds_total {}'.format(snapshot['tick_seconds']),
+        '# HELP epower_last_tick_seconds Duration of the latest tick.',
+        '# TYPE epower_last_tick_seconds gauge',
+        'epower_last_tick_seconds {}'.format(snapshot['last_tick']['seconds']),
+        '# HELP epower_last_tick_timestamp_seconds When the latest tick ended.',
+        '# TYPE epower_last_tick_timestamp_seconds gauge',
+        'epower_last_tick_timestamp_seconds {}'.format(snapshot['updated_at']),
+    ]
+
+    hook_metrics = [
+        ('calls_total', 'Calls of hooks', CALLS),
+        ('errors_total', 'Exceptions raised by hooks', ERRORS),
+        ('seconds_total', 'Time spent in hooks', SECONDS),
+        ('db_queries_total', 'Database queries made by hooks', QUERIES),
+        ('cache_round_trips_total', 'Cache round trips made by hooks', CACHE_ROUND_TRIPS),
+    ]
+    for suffix, help_text, index in hook_metrics:
+        name = f'epower_hook_{suffix}'
+        lines.append(f'# HELP {name} {help_text} of all Nodes.')
+        lines.append(f'# TYPE {name} counter')
+        for row in snapshot['hooks']:
+            lines.append('{}{{hook="{}"}} {}'.format(name, row[0], row[1 + index]))
+    for suffix, help_text, index in hook_metrics:
+        name = f'epower_node_hook_{suffix}'
+        lines.append(f'# HELP {name} {help_text} of the Nodes, whose hooks have taken the most time.')
+        lines.append(f'# TYPE {name} counter')
+        for row in snapshot['slowest_node_hooks']:
+            node_id, node_name, logic_class, hook_name = row[:4]
+            lines.append('{}{{node="{}",name="{}",logic="{}",hook="{}"}} {}'.format(
+                name,
+                node_id,
+                _escape_label(node_name),
+                _escape_label(logic_class),
+                hook_name,
+                row[4 + index],
+            ))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _get_totals(node, hook_name):
+    # Returns the values of the hook of the Node, and the sums of the hook over all Nodes
+    key = (node.id, hook_name)
+    values = _totals.get(key)
+    if values is None:
+        values = _totals[key] = [0, 0, 0.0, 0, 0]
+    hook_values = _hook_totals.get(hook_name)
+    if hook_values is None:
+        hook_values = _hook_totals[hook_name] = [0, 0, 0.0, 0, 0]
+    # Names may change, so the latest ones are kept
+    _node_labels[node.id] = (node.name, node.logic_class)
+    return values, hook_values
+
+
+def _publish(tick):
+    global _total_ticks, _total_tick_seconds
+    _total_ticks += 1
+    _total_tick_seconds += tick.seconds
+
+    summary = tick.get_summary()
+    logger.info(json.dumps(dict(event='tick', **summary)))
+
+    # The totals are stored after every tick, because the scheduler may sleep for minutes after it.
+    # Only sums and the slowest hooks of single Nodes are stored, so big graphs fit in one cache item.
+    with _totals_lock:
+        hooks = [[hook_name, *values] for hook_name, values in _hook_totals.items()]
+        slowest = heapq.nlargest(PUBLISHED_SLOWEST_NODE_HOOKS, _totals.items(), key=lambda item: item[1][SECONDS])
+        slowest_node_hooks = [
+            [node_id, *_node_labels.get(node_id, ('', '')), hook_name, *values]
+            for (node_id, hook_name), values in slowest
+        ]
+    cache.set(METRICS_CACHE_KEY, json.dumps({
+        'updated_at': time.time(),
+        'ticks': _total_ticks,
+        'tick_seconds': _total_tick_seconds,
+        'last_tick': summary,
+        'hooks': hooks,
+        'slowest_node_hooks': slowest_node_hooks,
+    }), METRICS_TIMEOUT)
+
+
+@contextlib.contextmanager
+def _count_cache_round_trips(tick):
+    # The cache object of this thread is wrapped only for the duration of the tick. Methods of
+    # the base class may call each other, so only the outermost calls are counted.
+    cache_backend = caches['default']
+    depth = [0]
+
+    def counting(method):
+        def counting_method(*args, **kwargs):
+            if depth[0] == 0:
+                tick.count_cache_round_trip()
+            depth[0] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+        return counting_method
+
+    for name in _CACHE_METHODS:
+        setattr(cache_backend, name, counting(getattr(cache_backend, name)))
+    try:
+        yield
+    finally:
+        for name in _CACHE_METHODS:
+            delattr(cache_backend, name)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0004_change_logic_class_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zone', models.CharField(max_length=50)),
+                ('start', models.DateTimeField()),
+                ('resolution', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'price history',
+                'unique_together': {('zone', 'start')},
+            },
+        ),
+    ]
@@ -4,7 +4,7 @@ from django.conf import settings
 from django.core.cache import cache
 from django.db import models
 
-from . import utils
+from . import state as state_module, utils
 
 
 class Node(models.Model):
@@ -19,11 +19,25 @@ class Node(models.Model):
     pos_x = models.FloatField(default=0)
     pos_y = models.FloatField(default=0)
 
+    # If set, then state is read from and written to this StateSession instead of directly to cache
+    _state_session = None
+
     def get_state(self):
+        if self._state_session is not None:
+            return self._state_session.get(self.id)
         return json.loads(cache.get(self._state_cache_key()) or '{}')
 
     def set_state(self, state):
-        return cache.set(self._state_cache_key(), json.dumps(state), 60 * 60 * 24 * 365)
+        if self._state_session is not None:
+            return self._state_session.set(self.id, state)
+        # Version is changed too, so that watchers of the states notice the change
+        cache.set_many(
+            {
+                self._state_cache_key(): json.dumps(state),
+                state_module.STATES_VERSION_CACHE_KEY: state_module.new_version(),
+            },
+            state_module.STATE_TIMEOUT,
+        )
 
     def get_logic(self):
 
@@ -42,7 +56,7 @@ class Node(models.Model):
         return self._cached_logic
 
     def _state_cache_key(self):
-        return f'node_state_{self.id}'
+        return state_module.get_cache_key(self.id)
 
     def __str__(self):
         return f'{self.name} ({self.logic_class})'
@@ -63,3 +77,31 @@ class Connection(models.Model):
         unique_together = (
             ('dest', 'dest_key'),
         )
+
+
+class PriceHistory(models.Model):
+    """Price of one period of the day-ahead market.
+
+    Prices are kept here for good, and the latest ones are cached in front of them.
+    """
+
+    # Bidding zone, for example the area code of ENTSO-E
+    zone = models.CharField(max_length=50)
+
+    start = models.DateTimeField()
+    # Length of the period in seconds
+    resolution = models.PositiveIntegerField()
+
+    # Same precision as PriceSeries has
+    price = models.DecimalField(max_digits=12, decimal_places=3)
+
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.zone} {self.start.isoformat()}: {self.price}'
+
+    class Meta:
+        unique_together = (
+            ('zone', 'start'),
+        )
+        verbose_name_plural = 'price history'
@@ -0,0 +1,179 @@
+import datetime
+import decimal
+import struct
+
+
+# NumPy is imported only inside the methods that use it. All Logics import this module through `prices`,
+# and the web server imports all Logics, but it rarely needs prices, so its workers start faster without NumPy.
+
+# Prices are stored as integers, in thousandths of the price unit (for example EUR/MWh).
+# This way sums of prices are exact, and equal sums can be compared reliably.
+PRICE_SCALE = 1000
+
+# Header of the binary format: version, start, resolution and number of prices
+_HEADER = struct.Struct('<Bqqq')
+_FORMAT_VERSION = 1
+
+
+class PriceSeries:
+    """Prices of contiguous periods that have the same length.
+
+    `start` is the beginning of the first period as epoch seconds, `resolution`
+    is the length of one period in seconds, and `prices` are integers in units
+    of 1 / PRICE_SCALE. Lookups by time are done with arithmetic, so they take
+    constant time, and sums of ranges are calculated from cached prefix sums.
+    """
+
+    def __init__(self, start, resolution, prices):
+        import numpy
+        self.start = int(start)
+        self.resolution = int(resolution)
+        self.prices = numpy.asarray(prices, dtype=numpy.int64)
+        self._prefix_sums = None
+
+    @classmethod
+    def from_blocks(cls, blocks, resolution):
+        """Creates a series from blocks of (start, end, price), where start and end are epoch seconds.
+
+        Prices are in units of 1 / PRICE_SCALE, and a block may cover several periods.
+        If blocks overlap, then the later one wins. Missing periods between the blocks
+        get the price of the previous period.
+        """
+        import numpy
+        blocks = [block for block in blocks if block[1] > block[0]]
+        if not blocks:
+            return cls(0, resolution, [])
+        first_start = min(start for start, end, price in blocks)
+        last_end = max(end for start, end, price in blocks)
+        prices = numpy.empty(-((first_start - last_end) // resolution), dtype=numpy.int64)
+        filled = numpy.zeros(len(prices), dtype=bool)
+        for start, end, price in blocks:
+            first = (start - first_start) // resolution
+            last = -((first_start - end) // resolution)
+            prices[first:last] = price
+            filled[first:last] = True
+        # Fill the gaps with the previous price
+        fill_indices = numpy.maximum.accumulate(numpy.where(filled, numpy.arange(len(prices)), 0))
+        return cls(first_start, resolution, prices[fill_indices])
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy
+        version, start, resolution, count = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f'Unsupported format version {version}')
+        prices = numpy.frombuffer(data, dtype='<i8', count=count, offset=_HEADER.size)
+        return cls(start, resolution, prices)
+
+    def to_bytes(self):
+        return _HEADER.pack(_FORMAT_VERSION, self.start, self.resolution, len(self.prices)) + \
+            self.prices.astype('<i8').tobytes()
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __eq__(self, other):
+        import numpy
+        if not isinstance(other, PriceSeries):
+            return NotImplemented
+        if len(self) == 0 and len(other) == 0:
+            return True
+        return self.start == other.start and self.resolution == other.resolution and \
+            numpy.array_equal(self.prices, other.prices)
+
+    def __repr__(self):
+        return f'<PriceSeries of {len(self)} prices from {self.get_start_datetime(0)} at {self.resolution} s>'
+
+    @property
+    def end(self):
+        """End of the last period as epoch seconds."""
+        return self.start + len(self.prices) * self.resolution
+
+    def get_starts(self):
+        """Returns beginnings of all periods as a NumPy array of epoch seconds."""
+        import numpy
+        return self.start + numpy.arange(len(self.prices), dtype=numpy.int64) * self.resolution
+
+    def get_period_start(self, index):
+        return self.start + index * self.resolution
+
+    def get_period_end(self, index):
+        return self.start + (index + 1) * self.resolution
+
+    def get_start_datetime(self, index):
+        return datetime.datetime.fromtimestamp(self.get_period_start(index), datetime.timezone.utc)
+
+    def get_end_datetime(self, index):
+        return datetime.datetime.fromtimestamp(self.get_period_end(index), datetime.timezone.utc)
+
+    def index_at(self, timestamp):
+        """Returns index of the period that contains the given epoch seconds.
+
+        The index can be negative or past the end, if the time is outside the series.
+        """
+        return (int(timestamp) - self.start) // self.resolution
+
+    def get_price_at(self, timestamp):
+        index = self.index_at(timestamp)
+        if index < 0 or index >= len(self.prices):
+            return None
+        return int(self.prices[index])
+
+    def get_prefix_sums(self):
+        """Returns sums of prices before every index, including the end. The first sum is zero."""
+        if self._prefix_sums is None:
+            import numpy
+            self._prefix_sums = numpy.concatenate(([0], numpy.cumsum(self.prices, dtype=numpy.int64)))
+        return self._prefix_sums
+
+    def get_sum(self, first, last):
+        """Returns the sum of prices from index `first` to, but not including, index `last`."""
+        prefix_sums = self.get_prefix_sums()
+        return int(prefix_sums[last] - prefix_sums[first])
+
+    def get_integral(self, start, end):
+        """Returns the sum of price times seconds over the given range of epoch seconds.
+
+        Parts of the range that are outside the series are not counted.
+        """
+        start = max(int(start), self.start)
+        end = min(int(end), self.end)
+        if start >= end:
+            return 0
+        first = self.index_at(start)
+        last = self.index_at(end - 1)
+        if first == last:
+            return int(self.prices[first]) * (end - start)
+        # Partial periods at both ends, and whole periods between them
+        return int(self.prices[first]) * (self.get_period_end(first) - start) + \
+            self.get_sum(first + 1, last) * self.resolution + \
+            int(self.prices[last]) * (end - self.get_period_start(last))
+
+    def get_window_sums(self, length):
+        """Returns sums of all ranges of `length` periods, indexed by their first period."""
+        import numpy
+        prefix_sums = self.get_prefix_sums()
+        if length > len(self.prices):
+            return numpy.empty(0, dtype=numpy.int64)
+        return prefix_sums[length:] - prefix_sums[:len(prefix_sums) - length]
+
+    def slice(self, first, last=None):
+        """Returns the periods from index `first` to, but not including, index `last`."""
+        first, last, step = slice(first, last).indices(len(self.prices))
+        last = max(first, last)
+        return PriceSeries(self.get_period_start(first), self.resolution, self.prices[first:last])
+
+    def slice_time(self, start, end=None):
+        """Returns the periods that overlap with the given range of epoch seconds."""
+        first = max(0, self.index_at(start))
+        if end is None:
+            return self.slice(first)
+        return self.slice(first, max(first, -((self.start - int(end)) // self.resolution)))
+
+
+def to_fixed_point(price):
+    return int((decimal.Decimal(price) * PRICE_SCALE).to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+
+
+def from_fixed_point(price):
+    return decimal.Decimal(int(price)) / PRICE_SCALE
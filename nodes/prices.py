@@ -1,103 +1,365 @@
-import dateutil
-import decimal
-import entsoe
-import json
-import pandas
-import xml.dom.minidom
+import datetime
+import functools
+import logging
+import math
+import re
+import uuid
+import xml.etree.ElementTree
 
+import dateutil.parser
+import pytz
+
+from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
 from django.utils import timezone
 
-from varstorage.models import Variable
+from varstorage import cache as var_cache
+
+from . import constants
+from .models import PriceHistory
+from .price_series import PriceSeries, from_fixed_point, to_fixed_point
+
+
+logger = logging.getLogger(__name__)
+
+
+ENTSOE_API_URL = 'https://web-api.tp.entsoe.eu/api'
+ENTSOE_API_TIMEOUT = 60
+ENTSOE_API_CHUNK_SIZE = 64 * 1024
+
+# Curve types of ENTSO-E time series. With fixed sized blocks every period has its own point,
+# but with variable sized blocks, a point lasts until the position of the next point.
+CURVE_TYPE_FIXED_BLOCKS = 'A01'
+CURVE_TYPE_VARIABLE_BLOCKS = 'A03'
+
+# How long time of the latest prices is kept in cache, in seconds. Older ones are found from PriceHistory.
+PRICES_KEEP_SECONDS = 48 * 60 * 60
+
+PRICE_HISTORY_BATCH_SIZE = 500
+
+# Day-ahead prices of the next day are published a little before this time, in the timezone of the market
+MARKET_TIMEZONE = 'Europe/Brussels'
+PUBLISH_TIME = datetime.time(13, 0)
+
+# Seconds to wait before retrying after failures. The delay is doubled after every failure in a row.
+FETCH_RETRY_MIN_DELAY = 60
+FETCH_RETRY_MAX_DELAY = 60 * 60
+# Seconds to wait, if prices should have been published already, but they are not yet available
+FETCH_NOT_PUBLISHED_DELAY = 10 * 60
+
+# Older versions stored prices as JSON under the key "prices", so the binary series has a key of its own
+PRICES_CACHE_KEY = 'price_series'
+PRICES_CACHE_TIMEOUT = 60 * 60 * 48
+PRICES_VERSION_CACHE_KEY = 'prices_version'
+PRICES_HANDLED_VERSION_CACHE_KEY = 'prices_handled_version'
+FETCH_NEXT_AT_CACHE_KEY = 'prices_fetch_next_at'
+FETCH_FAILURES_CACHE_KEY = 'prices_fetch_failures'
 
 
 def get_from_cache():
-    prices = cache.get('prices')
-    if not prices:
+    """Returns the latest prices. If they are not in cache, then they are read from PriceHistory to cache."""
+    prices = cache.get(PRICES_CACHE_KEY)
+    if prices:
+        return PriceSeries.from_bytes(prices)
+
+    area = get_price_area()
+    if not area:
         return None
-    prices = json.loads(prices)
-    return _fix_prices(prices)
+    return _cache_latest_prices(area)
 
 
 def store_to_cache(prices):
-    cache.set('prices', json.dumps(_unfix_prices(prices)), 60 * 60 * 48)
-    cache.set('prices_fetched_at', timezone.now().isoformat(), 60 * 60 * 48)
+    cache.set(PRICES_CACHE_KEY, prices.to_bytes(), PRICES_CACHE_TIMEOUT)
 
 
-def fetch_prices():
-    # If prices have been fetched recently, then don't return anything
-    if cache.get('prices'):
-        prices_fetched_at = cache.get('prices_fetched_at')
-        if prices_fetched_at:
-            prices_fetched_at = dateutil.parser.parse(prices_fetched_at)
-            if prices_fetched_at > timezone.now() - timezone.timedelta(hours=1):
-                return None
-
-    # Read settings. If something is missing or invalid, then give up immediately
-    countrycode = Variable.objects.get_value('countrycode')
-    entsoe_api_key = Variable.objects.get_value('entsoe_api_key')
-    if not countrycode or not entsoe_api_key:
+def get_version():
+    """Returns version of the prices. It changes every time new prices are fetched."""
+    version = cache.get(PRICES_VERSION_CACHE_KEY)
+    if version is None:
+        # If cache has been cleared, then start a new version. If another
+        # process does the same at the same time, use the one it created.
+        cache.add(PRICES_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(PRICES_VERSION_CACHE_KEY)
+    return version
+
+
+def get_handled_version():
+    """Returns the version of the prices, that Nodes have been informed about."""
+    return cache.get(PRICES_HANDLED_VERSION_CACHE_KEY)
+
+
+def set_handled_version(version):
+    cache.set(PRICES_HANDLED_VERSION_CACHE_KEY, version, None)
+
+
+def get_history(start, end, area=None):
+    """Returns prices of the given datetime range from PriceHistory as a PriceSeries.
+
+    If `area` is not given, then the one of the selected country is used.
+    """
+    area = area or get_price_area()
+    if not area:
         return None
-    if not isinstance(countrycode, str) or not isinstance(entsoe_api_key, str):
+    rows = PriceHistory.objects.filter(zone=area, start__gte=start, start__lt=end) \
+        .values_list('start', 'resolution', 'price')
+    return _history_rows_to_series(rows)
+
+
+def store_to_history(area, prices):
+    """Inserts prices to PriceHistory. Prices of the periods that already exist are updated."""
+    rows = [
+        PriceHistory(
+            zone=area,
+            start=prices.get_start_datetime(index),
+            resolution=prices.resolution,
+            price=from_fixed_point(price),
+        )
+        for index, price in enumerate(prices.prices.tolist())
+    ]
+    # MySQL finds the conflicting rows by itself, and it does not even allow telling the fields
+    unique_fields = None
+    if connection.features.supports_update_conflicts_with_target:
+        unique_fields = ['zone', 'start']
+    PriceHistory.objects.bulk_create(
+        rows,
+        batch_size=PRICE_HISTORY_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['resolution', 'price', 'fetched_at'],
+    )
+
+
+def get_price_area():
+    """Returns the ENTSO-E area of the selected country, or None if it is missing or not supported."""
+    countrycode = var_cache.get_value('countrycode')
+    if not countrycode or not isinstance(countrycode, str) or len(countrycode) != 2:
         return None
-    if len(countrycode) != 2:
+    price_source = constants.COUNTRIES.get(countrycode.upper(), {}).get('price_source', {})
+    if price_source.get('type') != 'entsoe':
         return None
+    return price_source.get('area')
+
+
+def get_missing_intervals(area, now=None):
+    """Returns (start, end) datetimes of the intervals, that should be known by now, but are missing from PriceHistory.
+
+    Prices are wanted from the beginning of yesterday to the end of today, and
+    after the prices of tomorrow have been published, to the end of tomorrow.
+    """
+    wanted_start, wanted_end, next_change = get_wanted_interval(now or timezone.now())
+    rows = PriceHistory.objects.filter(zone=area, start__gte=wanted_start, start__lt=wanted_end) \
+        .order_by('start').values_list('start', 'resolution')
+    intervals = []
+    covered_until = wanted_start
+    for start, resolution in rows:
+        if start > covered_until:
+            intervals.append((covered_until, start))
+        covered_until = max(covered_until, start + datetime.timedelta(seconds=resolution))
+    if covered_until < wanted_end:
+        intervals.append((covered_until, wanted_end))
+    return intervals
+
 
-    # Fetch fresh prices
-    client = entsoe.EntsoeRawClient(api_key=entsoe_api_key)
+def get_wanted_interval(now):
+    """Returns start and end of the prices that should be known at the given time, and when this changes."""
+    market_timezone = pytz.timezone(MARKET_TIMEZONE)
+    market_now = now.astimezone(market_timezone)
+    today = market_now.date()
 
-    # Decide time range. Go a little bit to the past and a little
-    # more to the future, so we are sure to get all the needed data.
+    def day_start(date):
+        return market_timezone.localize(datetime.datetime.combine(date, datetime.time()))
+
+    publish_time = market_timezone.localize(datetime.datetime.combine(today, PUBLISH_TIME))
+    if market_now < publish_time:
+        return day_start(today - datetime.timedelta(days=1)), day_start(today + datetime.timedelta(days=1)), \
+            publish_time
+    return day_start(today - datetime.timedelta(days=1)), day_start(today + datetime.timedelta(days=2)), \
+        day_start(today + datetime.timedelta(days=1))
+
+
+def fetch_prices():
+    """Fetches prices that are missing from PriceHistory, and updates the latest prices in cache.
+
+    Only the missing intervals are requested. After a failure, fetching is retried
+    with exponential backoff, and if nothing is missing, then nothing is done until
+    the next prices are published. This is run separately from the periodic tasks,
+    so a slow API never delays controlling the devices. Returns True if new prices
+    were stored.
+    """
     now = timezone.now()
-    start = pandas.Timestamp((now - timezone.timedelta(days=1)).strftime('%Y%m%d'))
-    end = pandas.Timestamp((now + timezone.timedelta(days=2)).strftime('%Y%m%d'))
-
-    # Fetch the data
-    xml_data = client.query_day_ahead_prices(countrycode.upper(), start, end)
-
-    # Parse XML to dict
-    xml_dom = xml.dom.minidom.parseString(xml_data)
-    prices = []
-    for period in xml_dom.getElementsByTagName('Period'):
-        period_start = dateutil.parser.parse(period.getElementsByTagName('start')[0].firstChild.wholeText)
-
-        period_resolution = period.getElementsByTagName('resolution')[0].firstChild.wholeText
-        if period_resolution != 'PT60M':
-            raise Exception(f'Unsupported period resolution {period_resolution}')
-
-        for hour, point in enumerate(period.getElementsByTagName('Point')):
-            point_start = (period_start + timezone.timedelta(hours=hour)).isoformat()
-            point_end = (period_start + timezone.timedelta(hours=hour + 1)).isoformat()
-            point_price = point.getElementsByTagName('price.amount')[0].firstChild.wholeText
-            prices.append({
-                'start': point_start,
-                'end': point_end,
-                'price': point_price,
-            })
-
-    # Keep only latest 48 hours
-    prices = sorted(prices, key=lambda price: price['start'])[-48:]
-
-    return _fix_prices(prices)
-
-
-def _fix_prices(prices_raw):
-    prices_fixed = []
-    for price in prices_raw:
-        prices_fixed.append({
-            'start': dateutil.parser.parse(price['start']),
-            'end': dateutil.parser.parse(price['end']),
-            'price': decimal.Decimal(price['price']),
-        })
-    return prices_fixed
-
-
-def _unfix_prices(prices):
-    prices_raw = []
-    for price in prices:
-        prices_raw.append({
-            'start': price['start'].isoformat(),
-            'end': price['end'].isoformat(),
-            'price': str(price['price']),
-        })
-    return prices_raw
+    next_at = cache.get(FETCH_NEXT_AT_CACHE_KEY)
+    if next_at and next_at > now.timestamp():
+        return False
+
+    # Read settings. If something is missing or invalid, then give up immediately.
+    # API key is not needed, if a local file stands in for the API.
+    area = get_price_area()
+    entsoe_api_key = var_cache.get_value('entsoe_api_key')
+    if not area:
+        return False
+    if not settings.ENTSOE_RESPONSE_FILE and (not entsoe_api_key or not isinstance(entsoe_api_key, str)):
+        return False
+
+    intervals = get_missing_intervals(area, now)
+    if not intervals:
+        cache.set(FETCH_NEXT_AT_CACHE_KEY, get_wanted_interval(now)[2].timestamp(), None)
+        return False
+
+    # Fetch and parse the data, and keep all of it in the history
+    stored = False
+    try:
+        for start, end in intervals:
+            prices = parse_day_ahead_prices(_query_entsoe_day_ahead_prices(
+                entsoe_api_key,
+                area,
+                start.astimezone(datetime.timezone.utc).strftime('%Y%m%d%H%M'),
+                end.astimezone(datetime.timezone.utc).strftime('%Y%m%d%H%M'),
+            ))
+            if len(prices):
+                store_to_history(area, prices)
+                stored = True
+    except Exception:
+        failures = (cache.get(FETCH_FAILURES_CACHE_KEY) or 0) + 1
+        delay = min(FETCH_RETRY_MAX_DELAY, FETCH_RETRY_MIN_DELAY * 2 ** min(failures - 1, 16))
+        cache.set(FETCH_FAILURES_CACHE_KEY, failures, None)
+        cache.set(FETCH_NEXT_AT_CACHE_KEY, now.timestamp() + delay, None)
+        logger.exception('Fetching prices failed {} times in a row, retrying in {} seconds'.format(failures, delay))
+    else:
+        cache.delete(FETCH_FAILURES_CACHE_KEY)
+        if not stored:
+            cache.set(FETCH_NEXT_AT_CACHE_KEY, now.timestamp() + FETCH_NOT_PUBLISHED_DELAY, None)
+
+    # Even if some of the intervals failed, the ones that succeeded are taken into use
+    if stored:
+        _cache_latest_prices(area)
+        cache.set(PRICES_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    return stored
+
+
+def parse_day_ahead_prices(chunks):
+    """Parses a day-ahead prices document of ENTSO-E to a PriceSeries.
+
+    The document is given as an iterable of bytes, and it is parsed incrementally,
+    so the whole document is never kept in memory. Periods may have different
+    resolutions, and the PriceSeries gets the finest one of them.
+    """
+    parser = xml.etree.ElementTree.XMLPullParser(events=('start', 'end'))
+    blocks = []
+    resolutions = set()
+    curve_type = CURVE_TYPE_FIXED_BLOCKS
+    period = {}
+    point = {}
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            # Ignore namespaces, they change between versions of the document
+            tag = element.tag.rpartition('}')[2]
+
+            if event == 'start':
+                if tag == 'Period':
+                    period = {'points': {}}
+                continue
+
+            if tag == 'curveType':
+                curve_type = element.text.strip()
+            elif tag in ('start', 'end'):
+                period[tag] = int(dateutil.parser.parse(element.text).timestamp())
+            elif tag == 'resolution':
+                period['resolution'] = _parse_resolution(element.text.strip())
+            elif tag in ('position', 'price.amount'):
+                point[tag] = element.text.strip()
+            elif tag == 'Point':
+                period['points'][int(point['position'])] = to_fixed_point(point['price.amount'])
+                point = {}
+                element.clear()
+            elif tag == 'Period':
+                blocks += _get_period_blocks(period, curve_type)
+                resolutions.add(period['resolution'])
+                element.clear()
+            elif tag == 'TimeSeries':
+                curve_type = CURVE_TYPE_FIXED_BLOCKS
+                element.clear()
+    parser.close()
+
+    if not resolutions:
+        return PriceSeries(0, 3600, [])
+    return PriceSeries.from_blocks(blocks, functools.reduce(math.gcd, resolutions))
+
+
+def _cache_latest_prices(area):
+    """Reads the latest prices from PriceHistory to cache, and returns them."""
+    rows = PriceHistory.objects.filter(zone=area, start__gte=timezone.now() - timezone.timedelta(days=2)) \
+        .values_list('start', 'resolution', 'price')
+    prices = _history_rows_to_series(rows)
+    if not len(prices):
+        return None
+    prices = prices.slice(-(PRICES_KEEP_SECONDS // prices.resolution))
+    store_to_cache(prices)
+    return prices
+
+
+def _history_rows_to_series(rows):
+    """Converts (start, resolution, price) rows of PriceHistory to a PriceSeries."""
+    blocks = []
+    resolutions = set()
+    for row in rows:
+        start = int(row[0].timestamp())
+        blocks.append((start, start + row[1], to_fixed_point(row[2])))
+        resolutions.add(row[1])
+    if not resolutions:
+        return PriceSeries(0, 3600, [])
+    return PriceSeries.from_blocks(blocks, functools.reduce(math.gcd, resolutions))
+
+
+def _parse_resolution(resolution):
+    match = re.fullmatch(r'PT(\d+)([MH])', resolution)
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f'Unsupported period resolution {resolution}')
+    return int(match.group(1)) * (60 if match.group(2) == 'M' else 3600)
+
+
+def _get_period_blocks(period, curve_type):
+    """Returns (start, end, price) blocks of a Period. Positions of the points start from one."""
+    positions = sorted(period['points'])
+    blocks = []
+    for i, position in enumerate(positions):
+        block_start = period['start'] + (position - 1) * period['resolution']
+        if curve_type == CURVE_TYPE_VARIABLE_BLOCKS:
+            # Point lasts until the next one, or until the end of the Period
+            if i + 1 < len(positions):
+                block_end = period['start'] + (positions[i + 1] - 1) * period['resolution']
+            else:
+                block_end = period['end']
+        else:
+            block_end = block_start + period['resolution']
+        blocks.append((block_start, min(block_end, period['end']), period['points'][position]))
+    return blocks
+
+
+def _query_entsoe_day_ahead_prices(api_key, area, start, end):
+    # A local file can stand in for the API, for example when testing
+    if settings.ENTSOE_RESPONSE_FILE:
+        with open(settings.ENTSOE_RESPONSE_FILE, 'rb') as response_file:
+            yield from iter(functools.partial(response_file.read, ENTSOE_API_CHUNK_SIZE), b'')
+        return
+
+    # Requests is imported only here, because it is not needed in most of the processes
+    import requests
+
+    response = requests.get(
+        ENTSOE_API_URL,
+        params={
+            'securityToken': api_key,
+            'documentType': 'A44',
+            'in_Domain': area,
+            'out_Domain': area,
+            'periodStart': start,
+            'periodEnd': end,
+        },
+        timeout=ENTSOE_API_TIMEOUT,
+        stream=True,
+    )
+    with response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=ENTSOE_API_CHUNK_SIZE)
@@ -0,0 +1,202 @@
+import cProfile
+import collections
+import contextlib
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+MODES = ('cprofile', 'sampling')
+
+DEFAULT_DIRECTORY = os.path.join(settings.BASE_DIR, 'logs', 'profiles')
+
+# How many profiled ticks are kept. The oldest ones are removed when new ones are written.
+DEFAULT_KEEP = 50
+
+# Seconds between the samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# Besides the thread that runs the tick, these threads are sampled too, because devices are controlled in them
+SAMPLED_THREAD_PREFIXES = ('aio', 'apply_state_to_devices')
+
+FILE_PREFIX = 'tick-'
+FILE_SUFFIXES = ('.pstats', '.collapsed')
+
+
+class TickProfiler:
+    """Profiles ticks of the periodic tasks, and writes the profiles of slow ticks to a directory.
+
+    "cprofile" mode writes pstats files, that can be read with `python -m pstats`, snakeviz or
+    gprof2dot. It only sees the thread that runs the tick. "sampling" mode samples the stacks of
+    that thread and the threads that control devices, and writes them as collapsed stacks, that
+    can be turned into flame graphs with flamegraph.pl, or opened in speedscope. Sampling slows
+    the tick down much less, so it is better for finding the causes of occasional slow ticks.
+    """
+
+    def __init__(self, mode='cprofile', directory=DEFAULT_DIRECTORY, keep=DEFAULT_KEEP, threshold_ms=0):
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode {mode}')
+        self.mode = mode
+        self.directory = directory
+        self.keep = keep
+        self.threshold_ms = threshold_ms
+
+    @classmethod
+    def from_options(cls, options):
+        """Returns a TickProfiler for options of a management command, or None if profiling is not enabled."""
+        if not options['profile']:
+            return None
+        return cls(
+            mode=options['profile'],
+            directory=options['profile_dir'],
+            keep=options['profile_keep'],
+            threshold_ms=options['profile_threshold'],
+        )
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Profiles the code inside this. The profile is written only if it took at least the threshold."""
+        started_at = datetime.datetime.now()
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+        else:
+            profiler = Sampler()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold_ms:
+                # Profiling must never stop the periodic tasks
+                try:
+                    self.write(profiler, started_at, duration_ms)
+                except Exception:
+                    logger.exception('Writing profile of a tick failed')
+
+    def write(self, profiler, started_at, duration_ms):
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{}{}-{:.0f}ms'.format(FILE_PREFIX, started_at.strftime('%Y%m%d-%H%M%S-%f'), duration_ms)
+        if self.mode == 'cprofile':
+            path = os.path.join(self.directory, name + '.pstats')
+            profiler.dump_stats(path)
+        else:
+            path = os.path.join(self.directory, name + '.collapsed')
+            profiler.dump_collapsed(path)
+        logger.info('Profile of a tick of {:.0f} ms was written to {}'.format(duration_ms, path))
+        self.remove_old()
+
+    def remove_old(self):
+        # Names start with the time, so they sort from the oldest to the newest
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIXES)
+        )
+        for name in names[:max(0, len(names) - self.keep)]:
+            os.remove(os.path.join(self.directory, name))
+
+
+class Sampler:
+    """Samples stacks of the thread that enables it, and of the threads that control devices.
+
+    Stacks are counted in the collapsed format of flamegraph.pl: frames from the root to
+    the leaf, separated with semicolons. The name of the thread is the root frame.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        # Collapsed stack -> number of samples
+        self.counts = collections.Counter()
+        self._labels = {}
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            thread_name = thread_names.get(thread_id, str(thread_id))
+            if thread_id != self._thread_id and not thread_name.startswith(SAMPLED_THREAD_PREFIXES):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._get_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread_name)
+            stack.reverse()
+            self.counts[';'.join(stack)] += 1
+
+    def dump_collapsed(self, path):
+        with open(path, 'w') as collapsed_file:
+            for stack, count in sorted(self.counts.items()):
+                collapsed_file.write(f'{stack} {count}\n')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def _get_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(str(settings.BASE_DIR)):
+                filename = os.path.relpath(filename, settings.BASE_DIR)
+            label = '{} ({}:{})'.format(code.co_name, filename, code.co_firstlineno).replace(';', ':')
+            self._labels[code] = label
+        return label
+
+
+def add_arguments(parser):
+    """Adds the profiling options to a management command, that runs periodic tasks."""
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='cprofile',
+        choices=MODES,
+        help='Profile every tick, with cProfile by default. "sampling" writes collapsed stacks for flame graphs, '
+             'and slows ticks down much less.',
+    )
+    parser.add_argument(
+        '--profile-dir',
+        default=DEFAULT_DIRECTORY,
+        help='Directory where the profiles are written.',
+    )
+    parser.add_argument(
+        '--profile-keep',
+        type=int,
+        default=DEFAULT_KEEP,
+        help='How many of the latest profiles are kept.',
+    )
+    parser.add_argument(
+        '--profile-threshold',
+        type=float,
+        default=0,
+        help='Write profiles only of ticks that took at least this many milliseconds, including the overhead '
+             'of profiling.',
+    )
+
+
+def profile_tick(profiler):
+    """Returns a context manager, that profiles a tick with the given TickProfiler, or does nothing if it is None."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile()
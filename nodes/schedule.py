@@ -0,0 +1,80 @@
+import bisect
+
+import dateutil.parser
+
+
+class Schedule:
+    """Sorted intervals of time, that do not overlap, and a value for each of them.
+
+    Intervals are (start, end, value) tuples, where start and end are epoch
+    seconds, and end is exclusive. The interval that contains some moment is
+    found with a binary search, so lookups take O(log n) time.
+    """
+
+    def __init__(self, intervals=()):
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self.intervals]
+
+    @classmethod
+    def from_state(cls, items, default_value=None):
+        """Creates a Schedule from a list that is stored in the state of a Node.
+
+        Items are [start, end] or [start, end, value] lists. Old states have
+        ISO datetime strings instead of epoch seconds, and those are converted.
+        """
+        intervals = []
+        for item in items:
+            value = item[2] if len(item) > 2 else default_value
+            intervals.append((_parse_timestamp(item[0]), _parse_timestamp(item[1]), value))
+        return cls(intervals)
+
+    def to_state(self, with_values=True):
+        if with_values:
+            return [[start, end, value] for start, end, value in self.intervals]
+        return [[start, end] for start, end, value in self.intervals]
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __bool__(self):
+        return bool(self.intervals)
+
+    def get_index_at(self, timestamp):
+        """Returns index of the interval that contains the given moment, or None."""
+        index = bisect.bisect_right(self._starts, timestamp) - 1
+        if index >= 0 and timestamp < self.intervals[index][1]:
+            return index
+        return None
+
+    def get_interval_at(self, timestamp):
+        index = self.get_index_at(timestamp)
+        if index is None:
+            return None
+        return self.intervals[index]
+
+    def get_next_change_time(self, timestamp):
+        """Returns the first moment after the given one, when an interval starts or ends, or None."""
+        index = bisect.bisect_right(self._starts, timestamp) - 1
+        if index >= 0 and timestamp < self.intervals[index][1]:
+            return self.intervals[index][1]
+        if index + 1 < len(self.intervals):
+            return self.intervals[index + 1][0]
+        return None
+
+    def get_last(self):
+        if not self.intervals:
+            return None
+        return self.intervals[-1]
+
+    def without_ended_before(self, timestamp):
+        """Returns a new Schedule without the intervals that ended before the given moment."""
+        return Schedule([interval for interval in self.intervals if interval[1] >= timestamp])
+
+    def with_added(self, intervals):
+        return Schedule(self.intervals + list(intervals))
+
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        return int(dateutil.parser.parse(value).timestamp())
+    return int(value)
@@ -30,12 +30,10 @@ class NodeSerializer(serializers.ModelSerializer):
         return obj.get_state()
 
     def get_inputs(self, obj):
-        logic = obj.get_logic()
-        return sorted(logic.get_input_keys())
+        return utils.get_logic_keys(obj.logic_class)[0]
 
     def get_outputs(self, obj):
-        logic = obj.get_logic()
-        return sorted(logic.get_output_keys())
+        return utils.get_logic_keys(obj.logic_class)[1]
 
     def create(self, validated_data):
         # Validate logic class
@@ -76,6 +74,17 @@ class NodeSerializer(serializers.ModelSerializer):
         return update_result
 
 
+class GraphChangesSerializer(serializers.Serializer):
+    """Batch of changes to the graph. Every item is validated by NodeSerializer or ConnectionSerializer."""
+
+    # Partial updates of Nodes, each with an "id"
+    nodes = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    # Partial updates of Connections, each with an "id"
+    connections = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    new_connections = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    deleted_connections = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+
 class ConnectionSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import graph, models
+
+
+@receiver(post_save, sender=models.Node)
+@receiver(post_delete, sender=models.Node)
+@receiver(post_save, sender=models.Connection)
+@receiver(post_delete, sender=models.Connection)
+def invalidate_compiled_graph(sender, **kwargs):
+    # Invalidate only after the changes are committed, so nobody
+    # can load the old graph and store it with the new version.
+    transaction.on_commit(graph.invalidate)
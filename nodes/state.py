@@ -0,0 +1,107 @@
+import json
+import uuid
+
+from django.core.cache import cache
+
+
+STATE_TIMEOUT = 60 * 60 * 24 * 365
+
+# Changes whenever states or outputs of any Nodes change, so watchers need to poll only this
+STATES_VERSION_CACHE_KEY = 'node_states_version'
+# Outputs of all Nodes from the latest round, as JSON object by Node IDs
+OUTPUTS_CACHE_KEY = 'node_outputs'
+
+
+def get_cache_key(node_id):
+    return f'node_state_{node_id}'
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def get_version():
+    version = cache.get(STATES_VERSION_CACHE_KEY)
+    if version is None:
+        # Like in the graph, use the version of another process if it created one at the same time
+        cache.add(STATES_VERSION_CACHE_KEY, new_version(), STATE_TIMEOUT)
+        version = cache.get(STATES_VERSION_CACHE_KEY)
+    return version
+
+
+def store_outputs(outputs, backend=None):
+    """Stores outputs of Nodes by their IDs, so they can be shown to users. Returns True if they changed."""
+    backend = backend or cache
+    stored_outputs = json.dumps({str(node_id): values for node_id, values in outputs.items()}, sort_keys=True)
+    if stored_outputs == backend.get(OUTPUTS_CACHE_KEY):
+        return False
+    backend.set_many({OUTPUTS_CACHE_KEY: stored_outputs, STATES_VERSION_CACHE_KEY: new_version()}, STATE_TIMEOUT)
+    return True
+
+
+class StateSession:
+    """Keeps states of Nodes in memory for the duration of a tick.
+
+    All states are fetched with a single `get_many()` when the session starts, and
+    while the session is active, `Node.get_state()` and `Node.set_state()` use the
+    in-memory copies. When the session ends, only those states whose content has
+    really changed are written back, with a single `set_many()`.
+
+    The dicts returned by `Node.get_state()` are shared, so if they are
+    modified, then the modifications must be saved with `Node.set_state()`.
+    """
+
+    def __init__(self, nodes, backend=None):
+        self.nodes = list(nodes)
+        self.backend = backend or cache
+        # Node ID -> state as it is stored in the cache
+        self._stored = {}
+        # Node ID -> decoded state
+        self._states = {}
+        # IDs of Nodes whose state has been set during the session
+        self._touched = set()
+
+    def __enter__(self):
+        self.load()
+        for node in self.nodes:
+            node._state_session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for node in self.nodes:
+            node._state_session = None
+        # States are flushed also when there was an error, because that was
+        # also the case when every change was written to cache immediately.
+        self.flush()
+
+    def load(self):
+        keys = {get_cache_key(node.id): node.id for node in self.nodes}
+        stored_states = self.backend.get_many(keys.keys())
+        for key, node_id in keys.items():
+            stored_state = stored_states.get(key)
+            self._stored[node_id] = stored_state
+            self._states[node_id] = json.loads(stored_state or '{}')
+
+    def get(self, node_id):
+        return self._states[node_id]
+
+    def set(self, node_id, state):
+        self._states[node_id] = state
+        self._touched.add(node_id)
+
+    def flush(self):
+        # Write only those states that really differ from the stored ones
+        changed = {}
+        for node_id in self._touched:
+            stored_state = json.dumps(self._states[node_id])
+            if stored_state != self._stored.get(node_id):
+                changed[node_id] = stored_state
+        self._touched = set()
+
+        if changed:
+            new_stored = {get_cache_key(node_id): stored_state for node_id, stored_state in changed.items()}
+            new_stored[STATES_VERSION_CACHE_KEY] = new_version()
+            self.backend.set_many(new_stored, STATE_TIMEOUT)
+            self._stored.update(changed)
+
+        return set(changed.keys())
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from concurrent import futures
+
+from django.conf import settings
+
+from varstorage import cache as var_cache
+
+from . import aio, engine, graph, metrics, prices, state
+
+
+logger = logging.getLogger(__name__)
+
+
+# Only one process may run the periodic tasks at a time
+LOCK_NAME = 'run_periodic_tasks'
+LOCK_TIMEOUT = 60 * 60 * 4
+
+# Prices are fetched separately from the periodic tasks, so they have a lock of their own
+FETCH_PRICES_LOCK_NAME = 'fetch_prices'
+FETCH_PRICES_LOCK_TIMEOUT = 60 * 30
+
+
+def run_periodic_tasks():
+    """Runs one round of periodic tasks: updated prices, propagation and applying state to devices.
+
+    Returns epoch seconds of the next moment, when outputs of some Node change even if nothing
+    else changes, or None if there is no such moment.
+    """
+    # Time, queries and cache round trips of every hook of every Node are recorded
+    with metrics.record_tick():
+        return _run_periodic_tasks()
+
+
+def _run_periodic_tasks():
+
+    # Fetch all Nodes and Connections to memory. This way, we don't have to fetch them
+    # multiple times, and they can do for example some local catching in them. The Logics
+    # inside Nodes are automatically cached too, so those can do the local caching too.
+    # The graph is kept in memory between rounds, and it is reloaded only if it changes.
+    compiled_graph = graph.get_compiled_graph()
+    nodes = compiled_graph.nodes
+
+    # States of all Nodes are loaded at once, and only the changed ones are written back at the end
+    with state.StateSession(nodes.values()):
+
+        # Let Logics know that a new round is starting, so they can forget values from the previous one
+        for node in nodes.values():
+            with metrics.hook(node, 'handle_tick_started'):
+                node.get_logic().handle_tick_started()
+
+        # Prices are fetched in the background. If they have changed since the previous round, then
+        # inform all Nodes about them. This way, fetching prices never delays controlling the devices.
+        prices_version = prices.get_version()
+        if prices_version != prices.get_handled_version():
+            latest_prices = prices.get_from_cache()
+            if latest_prices:
+                for node in nodes.values():
+                    with metrics.hook(node, 'handle_updated_prices'):
+                        node.get_logic().handle_updated_prices(latest_prices)
+            prices.set_handled_version(prices_version)
+
+        # Let connections flow through the network. Nodes are evaluated in topological order,
+        # and only possible cycles are iterated until they settle.
+        outputs = engine.propagate(compiled_graph)
+
+        # Outputs are stored only so they can be shown to users
+        state.store_outputs(outputs)
+
+        # Finally apply state to devices
+        apply_state_to_devices(nodes.values())
+
+        return get_next_change_time(nodes.values())
+
+
+def get_next_change_time(nodes):
+    """Returns the earliest moment, when outputs of the given Nodes change by themselves, or None."""
+    next_change_times = [
+        next_change_time
+        for next_change_time in (node.get_logic().get_next_change_time() for node in nodes)
+        if next_change_time is not None
+    ]
+    return min(next_change_times, default=None)
+
+
+def get_event_versions():
+    """Returns versions of the things, that should start a new round right away when they change.
+
+    Those are the graph, including settings of the Nodes, the prices and the Variables.
+    """
+    return (graph.get_version(), prices.get_version(), var_cache.get_version())
+
+
+def apply_state_to_devices(nodes):
+    """Applies state of Nodes to their devices concurrently.
+
+    Logics that implement `async_apply_state_to_devices()` are awaited in the event loop, and the
+    rest are run in a pool of threads at the same time. Every device has `DEVICE_APPLY_TIMEOUT`
+    seconds from the moment its update starts, and devices that take longer are not waited for.
+    """
+
+    # Only Logics that really control some devices need to be run
+    async_logics = []
+    sync_logics = []
+    for node in nodes:
+        logic = node.get_logic()
+        if logic.implements('async_apply_state_to_devices'):
+            async_logics.append(logic)
+        elif logic.implements('apply_state_to_devices'):
+            sync_logics.append(logic)
+
+    async_future = None
+    if async_logics:
+        async_future = aio.submit(_apply_state_to_devices_async(async_logics))
+
+    if sync_logics:
+        _apply_state_to_devices_in_threads(sync_logics)
+
+    if async_future:
+        async_future.result()
+
+
+async def _apply_state_to_devices_async(logics):
+    timeout = settings.DEVICE_APPLY_TIMEOUT
+
+    async def apply(logic):
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(logic.async_apply_state_to_devices(), timeout)
+        except asyncio.TimeoutError:
+            logger.error('Applying state of {} did not finish in {} s'.format(logic.node, timeout))
+            metrics.add(logic.node, 'async_apply_state_to_devices', time.monotonic() - started_at, True)
+        except Exception:
+            logger.exception('Applying state of {} failed after {:.2f} s'.format(
+                logic.node,
+                time.monotonic() - started_at,
+            ))
+            metrics.add(logic.node, 'async_apply_state_to_devices', time.monotonic() - started_at, True)
+        else:
+            logger.info('Applied state of {} in {:.2f} s'.format(logic.node, time.monotonic() - started_at))
+            metrics.add(logic.node, 'async_apply_state_to_devices', time.monotonic() - started_at)
+
+    await asyncio.gather(*[apply(logic) for logic in logics])
+
+
+def _apply_state_to_devices_in_threads(logics):
+    # Threads cannot be killed, so a stuck update keeps its worker, and if all
+    # workers get stuck, then the devices still waiting in queue are skipped.
+    timeout = settings.DEVICE_APPLY_TIMEOUT
+    workers = settings.DEVICE_APPLY_WORKERS
+    executor = futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='apply_state_to_devices')
+
+    started_at = {}
+
+    def apply(logic):
+        started_at[logic] = time.monotonic()
+        with metrics.hook(logic.node, 'apply_state_to_devices'):
+            logic.apply_state_to_devices()
+
+    pending = {executor.submit(apply, logic): logic for logic in logics}
+    timed_out = 0
+
+    while pending:
+        done, not_done = futures.wait(pending.keys(), timeout=0.1, return_when=futures.FIRST_COMPLETED)
+        now = time.monotonic()
+
+        for future in done:
+            logic = pending.pop(future)
+            duration = now - started_at.get(logic, now)
+            if future.exception():
+                logger.error(
+                    'Applying state of {} failed after {:.2f} s'.format(logic.node, duration),
+                    exc_info=future.exception(),
+                )
+            else:
+                logger.info('Applied state of {} in {:.2f} s'.format(logic.node, duration))
+
+        for future in not_done:
+            logic = pending[future]
+            if logic in started_at and now - started_at[logic] > timeout:
+                logger.error('Applying state of {} did not finish in {} s'.format(logic.node, timeout))
+                del pending[future]
+                timed_out += 1
+
+        # If all workers are stuck, then the rest of the devices would never get their turn
+        if timed_out >= workers:
+            for future, logic in pending.items():
+                if future.cancel():
+                    logger.error('Applying state of {} was skipped, because all workers are stuck'.format(logic.node))
+            pending = {future: logic for future, logic in pending.items() if not future.cancelled()}
+
+    executor.shutdown(wait=False, cancel_futures=True)
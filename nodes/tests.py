@@ -0,0 +1,203 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from varstorage.models import Variable
+
+from . import engine, graph, models, prices
+from .benchmark import CountingLocMemCache
+from .logics import logic
+from .price_series import PriceSeries
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'nodes.benchmark.CountingLocMemCache',
+        'LOCATION': 'tests',
+    },
+})
+class NodeListRoundTripsTestCase(TestCase):
+    """Listing Nodes takes the same number of database queries and cache round trips for any number of Nodes."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('tester', password='tester')
+        self.client.force_login(user)
+
+    def test_round_trips_do_not_depend_on_node_count(self):
+        self.create_nodes(3)
+        with CaptureQueriesContext(connection) as queries:
+            small_round_trips = self.list_nodes(3)
+
+        self.create_nodes(50)
+        with self.assertNumQueries(len(queries)):
+            large_round_trips = self.list_nodes(53)
+
+        self.assertEqual(large_round_trips, small_round_trips)
+
+    def create_nodes(self, count):
+        previous = None
+        for index in range(count):
+            node = models.Node.objects.create(
+                name=f'Node {models.Node.objects.count()}',
+                logic_class='nodes.logics.select_value.SelectValue',
+                settings={'value_on': 1, 'value_off': 0},
+            )
+            node.set_state({'value': index})
+            if previous:
+                models.Connection.objects.create(source=previous, source_key='output', dest=node, dest_key='input')
+            previous = node
+
+    def list_nodes(self, expected_count):
+        CountingLocMemCache.round_trips = 0
+        response = self.client.get('/api/v1/nodes/')
+        round_trips = CountingLocMemCache.round_trips
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), expected_count)
+        return round_trips
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+})
+class PricesCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Variable.objects.create(name='countrycode', value='FI')
+
+    def test_prices_of_old_versions_in_cache_are_ignored(self):
+        # Older versions stored prices as JSON under the key "prices"
+        cache.set('prices', json.dumps([{'start': '2024-01-01T00:00:00+00:00', 'price': '1.23'}]), 60 * 60 * 48)
+        start = int(time.time()) // 3600 * 3600 - 3600 * 12
+        series = PriceSeries(start, 3600, [index * 1000 for index in range(24)])
+        prices.store_to_history(prices.get_price_area(), series)
+
+        self.assertEqual(prices.get_from_cache(), series)
+
+
+class RecordingLogic(logic.Logic):
+    """Outputs the largest of its inputs and its own value, and records when its inputs are handled."""
+
+    def __init__(self, node, value, calls):
+        super().__init__(node)
+        self.value = value
+        self.calls = calls
+        self.inputs = {}
+
+    def handle_inputs_changed(self, inputs):
+        self.calls.append(self.node.id)
+        self.inputs = inputs
+
+    def get_output_values(self):
+        values = [value for value in self.inputs.values() if value is not None]
+        return {'output': max(values + [self.value])}
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+})
+class PropagateTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def create_graph(self, values, connections):
+        # Nodes are not saved, so their Logics can be replaced
+        nodes = {}
+        for node_id, value in values.items():
+            node = models.Node(id=node_id, name=f'Node {node_id}')
+            node._cached_logic = RecordingLogic(node, value, self.calls)
+            nodes[node_id] = node
+        return graph.CompiledGraph(nodes, [
+            (source_id, 'output', dest_id, dest_key)
+            for source_id, dest_id, dest_key in connections
+        ])
+
+    def test_nodes_are_evaluated_after_their_sources(self):
+        # IDs are in the opposite order of the connections, and Nodes 2 and 3 are on the same level
+        compiled_graph = self.create_graph({1: 0, 2: 0, 3: 5, 4: 7}, [
+            (4, 3, 'input'),
+            (4, 2, 'input'),
+            (3, 1, 'input1'),
+            (2, 1, 'input2'),
+        ])
+
+        self.assertEqual(
+            [sorted(node_id for component in level for node_id in component) for level in compiled_graph.get_levels()],
+            [[4], [2, 3], [1]],
+        )
+
+        outputs = engine.propagate(compiled_graph)
+
+        # Every Node is evaluated once, after its sources
+        self.assertEqual(self.calls[0], 4)
+        self.assertEqual(sorted(self.calls[1:3]), [2, 3])
+        self.assertEqual(self.calls[3], 1)
+        self.assertEqual(outputs, {1: {'output': 7}, 2: {'output': 7}, 3: {'output': 7}, 4: {'output': 7}})
+
+    def test_cycle_settles(self):
+        # Nodes 2 and 3 feed each other, and Node 1 feeds the cycle
+        compiled_graph = self.create_graph({1: 3, 2: 0, 3: 0}, [
+            (1, 2, 'input1'),
+            (3, 2, 'input2'),
+            (2, 3, 'input'),
+        ])
+
+        self.assertTrue(compiled_graph.is_cycle(compiled_graph.get_levels()[1][0]))
+
+        outputs = engine.propagate(compiled_graph)
+
+        self.assertEqual(outputs, {1: {'output': 3}, 2: {'output': 3}, 3: {'output': 3}})
+        # Inputs are handled again only while they change, so the cycle stops well before the limit
+        self.assertLess(len(self.calls), 1 + 2 * engine.MAX_CYCLE_ITERATIONS)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+})
+class CompiledGraphTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        graph._compiled_graph = None
+
+    def tearDown(self):
+        graph._compiled_graph = None
+
+    def test_adding_connection_invalidates_graph(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            source = models.Node.objects.create(name='Source', logic_class='nodes.logics.clock.Clock', settings={})
+            dest = models.Node.objects.create(
+                name='Dest',
+                logic_class='nodes.logics.select_value.SelectValue',
+                settings={},
+            )
+        compiled_graph = graph.get_compiled_graph()
+        self.assertEqual(compiled_graph.inputs, {})
+        self.assertIs(graph.get_compiled_graph(), compiled_graph)
+
+        # The version changes only when the Connection is committed
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            models.Connection.objects.create(source=source, source_key='power', dest=dest, dest_key='input')
+            self.assertIs(graph.get_compiled_graph(), compiled_graph)
+        self.assertEqual(len(callbacks), 1)
+
+        compiled_graph = graph.get_compiled_graph()
+        self.assertEqual(compiled_graph.inputs, {dest.id: [('input', source.id, 'power')]})
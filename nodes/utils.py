@@ -1,7 +1,42 @@
+import datetime
+import functools
 import importlib
 import pytz.exceptions
 
-from varstorage import models as var_models
+from django.conf import settings
+from django.utils import timezone
+
+from varstorage import cache as var_cache
+
+
+# Name of the configured timezone, and the timezone object of it
+_configured_timezone = (None, pytz.UTC)
+
+# If set, then now() returns the time of this VirtualClock instead of the real time
+_virtual_clock = None
+
+
+class VirtualClock:
+    """Simulated time for backtests. While this is active, `now()` returns `timestamp` as the current time."""
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+    def __enter__(self):
+        global _virtual_clock
+        _virtual_clock = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _virtual_clock
+        _virtual_clock = None
+
+
+def now():
+    """Returns the current time. Logics must use this instead of `timezone.now()`, so they can be backtested."""
+    if _virtual_clock is not None:
+        return datetime.datetime.fromtimestamp(_virtual_clock.timestamp, datetime.timezone.utc)
+    return timezone.now()
 
 
 def import_dot_path(path):
@@ -12,9 +47,25 @@ def import_dot_path(path):
     return getattr(module, var_name)
 
 
+@functools.lru_cache(maxsize=None)
+def get_logic_keys(logic_class):
+    """Returns sorted input and output keys of a Logic class.
+
+    Keys never depend on the Node, so they are resolved only once per class.
+    """
+    # Some extra security, make sure logic class is allowed in settings
+    if logic_class not in settings.NODE_LOGIC_CLASSES:
+        raise Exception('Invalid logic_class!')
+    logic = import_dot_path(logic_class)(None)
+    return sorted(logic.get_input_keys()), sorted(logic.get_output_keys())
+
+
 def get_configured_timezone():
-    timezone_name = var_models.Variable.objects.get_value('timezone')
-    try:
-        return pytz.timezone(timezone_name)
-    except pytz.exceptions.UnknownTimeZoneError:
-        return pytz.UTC
+    global _configured_timezone
+    timezone_name = var_cache.get_value('timezone')
+    if timezone_name != _configured_timezone[0]:
+        try:
+            _configured_timezone = (timezone_name, pytz.timezone(timezone_name))
+        except pytz.exceptions.UnknownTimeZoneError:
+            _configured_timezone = (timezone_name, pytz.UTC)
+    return _configured_timezone[1]
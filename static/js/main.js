@@ -6,6 +6,10 @@ UI.nodes = {};
 UI.connections = {};
 UI.settings = {};
 UI.static_data = {};
+// States and outputs of nodes, that are streamed from the server
+UI.live = {};
+UI.live_connected = false;
+UI.output_texts = {};
 
 function stripTags(str)
 {
@@ -657,16 +661,12 @@ function handleMouseUp(event)
             // Update position to server
             var new_pos_x = event.originalEvent.x - UI.moving_node_offset_x;
             var new_pos_y = event.originalEvent.y - UI.moving_node_offset_y;
-            $.ajax({
-                url: '/api/v1/nodes/' + UI.moving_node_id + '/',
-                method: 'PATCH',
-                headers: {'X-CSRFToken': window.csrf_token},
-                data: JSON.stringify({
+            saveGraphChanges({
+                nodes: [{
+                    id: UI.moving_node_id,
                     pos_x: new_pos_x,
                     pos_y: new_pos_y,
-                }),
-                dataType: 'json',
-                contentType: 'application/json; charset=utf-8',
+                }],
             });
             // Mark moving stopped
             UI.moving_node_id = null;
@@ -990,6 +990,8 @@ function reconstructNodesAndConnectionsToUi()
         nodes_svg[0].remove();
     }
 
+    UI.output_texts = {};
+
     // Make a map for positions where connections should be connected to
     var input_output_poss = [];
     for (var [node_id, node] of Object.entries(UI.nodes)) {
@@ -1109,43 +1111,101 @@ function reconstructNodesAndConnectionsToUi()
                 }
             });
             // Text
-            node_svg.appendChild(makeSvgElement('text', {
+            UI.output_texts[node.id + '_o_' + output_key] = node_svg.appendChild(makeSvgElement('text', {
                 x: 200 - 8,
                 y: 36 + 12 * output_i,
                 class: 'input_output_name',
                 'text-anchor': 'end',
-            })).textContent = output_key;
+            }));
+        }
+    }
+
+    updateLiveValuesToUi();
+}
+
+function updateLiveValuesToUi()
+{
+    for (var [node_id, node] of Object.entries(UI.nodes)) {
+        const live = UI.live[node.id];
+        for (const output_key of node.outputs) {
+            var text = UI.output_texts[node.id + '_o_' + output_key];
+            if (!text) {
+                continue;
+            }
+            if (live && output_key in live.outputs) {
+                text.textContent = output_key + ' = ' + JSON.stringify(live.outputs[output_key]);
+            } else {
+                text.textContent = output_key;
+            }
         }
     }
 }
 
+function startLiveStream()
+{
+    // The server ends streams every now and then, and the browser reconnects automatically
+    var source = new EventSource('/api/v1/nodes/stream/');
+    source.addEventListener('open', function() {
+        UI.live_connected = true;
+    });
+    source.addEventListener('error', function() {
+        UI.live_connected = false;
+    });
+    source.addEventListener('snapshot', function(event) {
+        UI.live = JSON.parse(event.data).nodes;
+        updateLiveValuesToUi();
+    });
+    source.addEventListener('update', function(event) {
+        const data = JSON.parse(event.data);
+        for (var [node_id, node_live] of Object.entries(data.nodes)) {
+            UI.live[node_id] = node_live;
+        }
+        for (const node_id of data.removed) {
+            delete UI.live[node_id];
+        }
+        updateLiveValuesToUi();
+    });
+    source.addEventListener('graph', function() {
+        fetchDataAndUpdateUi().then();
+    });
+}
+
 function fetchDataAndUpdateUi()
 {
     return new Promise(function(resolve, reject) {
+        // The browser sends the ETag of the previous snapshot, and gets nothing if the graph has not changed
         $.ajax({
-            url: '/api/v1/nodes/',
+            url: '/api/v1/graph/',
+            ifModified: true,
         }).then(
-            function(nodes_data, text_status, request) {
-                $.ajax({ url: '/api/v1/connections/' }).then(
-                    function(connections_data, text_status, request) {
-                        // Convert arrays into objects
-                        var nodes = {};
-                        var connections = {};
-                        nodes_data.forEach(function(node) {
-                            nodes[node.id] = node;
-                        })
-                        connections_data.forEach(function(connection) {
-                            connections[connection.id] = connection;
-                        })
-
-                        handleNewDataFromServer(nodes, connections);
-
-                        resolve();
-                    },
-                    function(request, text_status, error_thrown) {
-                        reject();
-                    },
-                );
+            function(graph_data, text_status, request) {
+                if (text_status != 'notmodified') {
+                    handleNewGraphFromServer(graph_data);
+                }
+                resolve();
+            },
+            function(request, text_status, error_thrown) {
+                reject();
+            },
+        );
+    });
+}
+
+function saveGraphChanges(changes)
+{
+    // Changes are applied in one transaction, and the response is the new snapshot
+    return new Promise(function(resolve, reject) {
+        $.ajax({
+            url: '/api/v1/graph/',
+            method: 'POST',
+            headers: {'X-CSRFToken': window.csrf_token},
+            data: JSON.stringify(changes),
+            dataType: 'json',
+            contentType: 'application/json; charset=utf-8',
+        }).then(
+            function(graph_data, text_status, request) {
+                handleNewGraphFromServer(graph_data);
+                resolve();
             },
             function(request, text_status, error_thrown) {
                 reject();
@@ -1154,6 +1214,21 @@ function fetchDataAndUpdateUi()
     });
 }
 
+function handleNewGraphFromServer(graph_data)
+{
+    // Convert arrays into objects
+    var nodes = {};
+    var connections = {};
+    graph_data.nodes.forEach(function(node) {
+        nodes[node.id] = node;
+    })
+    graph_data.connections.forEach(function(connection) {
+        connections[connection.id] = connection;
+    })
+
+    handleNewDataFromServer(nodes, connections);
+}
+
 function fetchVariables(names)
 {
     const name = names[0];
@@ -1232,16 +1307,23 @@ $(window).on('load', function() {
     ]).then(
         function() {
             // Now start fetching nodes data
+            startLiveStream();
             fetchDataAndUpdateUi().then(
                 function() {
                     setInterval(function() {
-                        fetchDataAndUpdateUi().then();
+                        // Polling is needed only if the stream is not working
+                        if (!UI.live_connected) {
+                            fetchDataAndUpdateUi().then();
+                        }
                     }, 5000);
                     fetchSettings();
                 },
                 function() {
                     setInterval(function() {
-                        fetchDataAndUpdateUi().then();
+                        // Polling is needed only if the stream is not working
+                        if (!UI.live_connected) {
+                            fetchDataAndUpdateUi().then();
+                        }
                     }, 5000);
                     fetchSettings();
                 },
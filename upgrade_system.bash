@@ -12,6 +12,14 @@ sudo -H -u epower bash -c "cd ~epower/epower && source venv/bin/activate && ./ma
 # Restart uWSGI
 /usr/sbin/service uwsgi restart
 
+# Upgrade and restart the ASGI service, that serves the streams of node states
+cp ~epower/epower/ansible/files/epower_asgi.service /etc/systemd/system/epower_asgi.service
+cp ~epower/epower/ansible/files/epower_nginx /etc/nginx/sites-available/epower
+systemctl daemon-reload
+systemctl enable -q epower_asgi
+systemctl restart epower_asgi
+/usr/sbin/service nginx reload
+
 # Upgrade the script that checks updates
 cp ~epower/epower/ansible/files/check_updates.bash ~/check_updates.bash
 chmod +x ~/check_updates.bash
@@ -19,3 +27,10 @@ chmod +x ~/check_updates.bash
 # Upgrade the cron script
 sudo -H -u epower bash -c "cp ~epower/epower/ansible/files/cron.bash ~epower/epower/cron.bash"
 sudo -H -u epower bash -c "chmod +x ~epower/epower/cron.bash"
+
+# Upgrade and restart the scheduler service, that replaces the old crontab of periodic tasks
+cp ~epower/epower/ansible/files/epower_scheduler.service /etc/systemd/system/epower_scheduler.service
+systemctl daemon-reload
+systemctl enable -q epower_scheduler
+systemctl restart epower_scheduler
+crontab -u epower -l 2>/dev/null | grep -v -e "cron.bash" -e "Run epower periodic tasks" | crontab -u epower -
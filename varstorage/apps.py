@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class VarstorageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'varstorage'
+
+    def ready(self):
+        from . import signals  # NOQA
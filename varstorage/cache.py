@@ -0,0 +1,62 @@
+import time
+import uuid
+
+from django.core.cache import cache
+
+from . import models
+
+
+VERSION_CACHE_KEY = 'varstorage_version'
+
+# How often, in seconds, the version is checked from the cache at most. Changes made
+# by other processes may be unnoticed this long, but changes of this process never are.
+VERSION_CHECK_INTERVAL = 1
+
+_values = None
+_version = None
+_version_checked_at = None
+
+
+def get_value(name, default=None):
+    """Returns the value of a Variable, or `default` if it does not exist.
+
+    All Variables are loaded to process memory with a single query, and they are reloaded only when
+    some of them is modified, by any process. The returned values are shared, so they may not be modified.
+    """
+    return _get_values().get(name, default)
+
+
+def get_values():
+    """Returns values of all Variables as a dict by their names."""
+    return dict(_get_values())
+
+
+def get_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # If cache has been cleared, then start a new version. If another
+        # process does the same at the same time, use the one it created.
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate():
+    global _values
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    _values = None
+
+
+def _get_values():
+    global _values, _version, _version_checked_at
+
+    now = time.monotonic()
+    if _values is not None and now - _version_checked_at < VERSION_CHECK_INTERVAL:
+        return _values
+
+    version = get_version()
+    _version_checked_at = now
+    if _values is None or version != _version:
+        _values = dict(models.Variable.objects.values_list('name', 'value'))
+        _version = version
+    return _values
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache, models
+
+
+@receiver(post_save, sender=models.Variable)
+@receiver(post_delete, sender=models.Variable)
+def invalidate_cached_variables(sender, **kwargs):
+    # Invalidate only after the changes are committed, so nobody
+    # can load the old Variables and store them with the new version.
+    transaction.on_commit(cache.invalidate)